@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import datetime
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+import health_check
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def make_series(points, cadence=60, gap_rate=0.0005, seed=1):
+    rng = np.random.default_rng(seed)
+    steps = np.full(points, cadence * 1000000, dtype=np.int64)
+    gaps = rng.random(points) < gap_rate
+    steps[gaps] *= rng.integers(4, 500, size=int(gaps.sum()))
+    start = int((datetime.datetime(2020, 1, 1) - EPOCH).total_seconds()) * 1000000
+    return start + np.cumsum(steps)
+
+
+def run_python(timestamps):
+    timestamps = sorted(set(timestamps))
+    min_interval = health_check.find_min_interval(timestamps)
+    gaps = health_check.find_significant_gaps(timestamps, min_interval, factor=3)
+    return [(start, end) for start, end, _ in health_check.group_gaps(gaps)]
+
+
+def run_numpy(ts_us):
+    (gap_start, gap_end, _), _ = health_check.np_series_gaps(np.zeros(len(ts_us), dtype=np.int64), ts_us)
+    return [
+        (EPOCH + datetime.timedelta(microseconds=int(a)), EPOCH + datetime.timedelta(microseconds=int(b)))
+        for a, b in zip(gap_start, gap_end)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение Python- и NumPy-поиска пропусков")
+    parser.add_argument('--points', type=int, default=10000000, help="Число точек ряда")
+    args = parser.parse_args()
+
+    ts_us = make_series(args.points)
+    timestamps = [EPOCH + datetime.timedelta(microseconds=int(us)) for us in ts_us]
+
+    started = time.perf_counter()
+    python_gaps = run_python(timestamps)
+    python_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    numpy_gaps = run_numpy(ts_us)
+    numpy_time = time.perf_counter() - started
+
+    print(f"Точек: {args.points}, пропусков: {len(python_gaps)}")
+    print(f"Python: {python_time:.3f} с")
+    print(f"NumPy:  {numpy_time:.3f} с (ускорение x{python_time / numpy_time:.1f})")
+    print(f"Результаты совпадают: {'да' if python_gaps == numpy_gaps else 'НЕТ'}")
+    if python_gaps != numpy_gaps:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк и проверка корректности health_check на синтетических данных.
+
+Без --dsn анализ запускается на SQLite-заменителе соединения; с --dsn данные
+загружаются в таблицы bench_series/bench_events указанной (тестовой!) базы
+PostgreSQL и сравниваются все движки из TIME_SERIES_ENGINES и EVENT_ENGINES.
+Память - пик по tracemalloc, то есть выделения Python и numpy без буферов libpq.
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+import health_check
+from synthetic import SQLiteConnection, generate_events, generate_series, to_datetime
+
+SERIES_TABLE = 'bench_series'
+EVENTS_TABLE = 'bench_events'
+
+
+def measure(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def report(name, rows, elapsed, peak):
+    print(f"  {name:<32} {elapsed:8.3f} с {rows / elapsed if elapsed else 0:14,.0f} строк/с "
+          f"{peak / 1024 / 1024:9.1f} МБ")
+
+
+def python_series_gaps(series):
+    all_gaps = []
+    for values in series.values():
+        timestamps = sorted(set(to_datetime(us) for us in values))
+        min_interval = health_check.find_min_interval(timestamps)
+        if min_interval is None:
+            continue
+        gaps = health_check.find_significant_gaps(timestamps, min_interval, factor=3)
+        all_gaps.extend(health_check.group_gaps(gaps))
+    return [(start, end) for start, end, _ in health_check.group_gaps(sorted(all_gaps, key=lambda x: x[0]))]
+
+
+def numpy_series_gaps(series):
+    stations = np.concatenate([np.full(len(v), i, dtype=np.int64) for i, v in enumerate(series.values())])
+    order = np.lexsort((np.concatenate(list(series.values())), stations))
+    ts_us = np.concatenate(list(series.values()))[order]
+    (gap_start, gap_end, gap_total), _ = health_check.np_series_gaps(stations[order], ts_us)
+    gaps = [(to_datetime(a), to_datetime(b), t) for a, b, t in zip(gap_start, gap_end, gap_total)]
+    return [(start, end) for start, end, _ in health_check.group_gaps(sorted(gaps, key=lambda x: x[0]))]
+
+
+def stream_series_gaps(series):
+    medians = {}
+    for station, values in series.items():
+        medians[station] = health_check.find_min_interval(sorted(set(to_datetime(us) for us in values)))
+    rows = ((station, to_datetime(us)) for station in sorted(series) for us in np.sort(series[station]))
+    gaps = [value for kind, _, value in health_check.iter_station_gaps(rows, medians) if kind == 'gap']
+    return [(start, end) for start, end, _ in health_check.group_gaps(sorted(gaps, key=lambda x: x[0]))]
+
+
+def numpy_event_ranges(starts, ends):
+    order = np.argsort(starts, kind='stable')
+    grouped = health_check.np_event_gaps(starts[order], ends[order])
+    if grouped is None:
+        return []
+    return [(to_datetime(a).strftime('%d.%m.%Y'), to_datetime(b).strftime('%d.%m.%Y'))
+            for a, b in zip(grouped[0], grouped[1])]
+
+
+def report_ranges(table_report):
+    return [(start.strftime('%d.%m.%Y'), end.strftime('%d.%m.%Y')) for start, end, _ in table_report.gaps]
+
+
+def check(name, ok, failures):
+    print(f"  {name:<60} {'OK' if ok else 'РАСХОЖДЕНИЕ'}")
+    if not ok:
+        failures.append(name)
+
+
+def load_postgres(conn, series, starts, ends):
+    with conn.cursor() as cur:
+        cur.execute(f'DROP TABLE IF EXISTS "{SERIES_TABLE}", "{EVENTS_TABLE}"')
+        cur.execute(f'CREATE TABLE "{SERIES_TABLE}" (station_id text, date timestamp)')
+        cur.execute(f'CREATE TABLE "{EVENTS_TABLE}" (start timestamp, "end" timestamp)')
+        buf = io.StringIO()
+        for station, values in series.items():
+            for us in values:
+                buf.write(f"{station}\t{to_datetime(us)}\n")
+        buf.seek(0)
+        cur.copy_expert(f'COPY "{SERIES_TABLE}" FROM STDIN', buf)
+        buf = io.StringIO("".join(f"{to_datetime(s)}\t{to_datetime(e)}\n" for s, e in zip(starts, ends)))
+        cur.copy_expert(f'COPY "{EVENTS_TABLE}" FROM STDIN', buf)
+        cur.execute(f'ANALYZE "{SERIES_TABLE}"')
+        cur.execute(f'ANALYZE "{EVENTS_TABLE}"')
+    conn.commit()
+
+
+def run_postgres(dsn, series, starts, ends, series_rows, failures):
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        load_postgres(conn, series, starts, ends)
+        print("\nPostgreSQL, временные ряды:")
+        expected = None
+        for engine in ['python'] + sorted(e for e in health_check.TIME_SERIES_ENGINES if e != 'python'):
+            func = health_check.TIME_SERIES_ENGINES[engine]
+            result, elapsed, peak = measure(func, conn, SERIES_TABLE, 'date', 'station_id')
+            report(engine, series_rows, elapsed, peak)
+            text = str(result)
+            if expected is None:
+                expected = text
+            elif engine == 'approx':
+                check(f"{engine}: диапазоны совпадают с python", text.replace(' ?)', ')') == expected, failures)
+            else:
+                check(f"{engine}: отчёт совпадает с python", text == expected, failures)
+
+        print("\nPostgreSQL, события:")
+        expected, elapsed, peak = measure(health_check.analyze_event_table, conn, EVENTS_TABLE, 'start', 'end')
+        report('python', len(starts), elapsed, peak)
+        for engine, func in sorted(health_check.EVENT_ENGINES.items()):
+            result, elapsed, peak = measure(func, conn, EVENTS_TABLE, 'start', 'end')
+            report(engine, len(starts), elapsed, peak)
+            check(f"{engine}: отчёт совпадает с python", str(result) == str(expected), failures)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP TABLE IF EXISTS "{SERIES_TABLE}", "{EVENTS_TABLE}"')
+        conn.commit()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк и проверка корректности health_check")
+    parser.add_argument('--stations', type=int, default=20, help="Число станций")
+    parser.add_argument('--points', type=int, default=50000, help="Точек на станцию")
+    parser.add_argument('--events', type=int, default=20000, help="Число событий")
+    parser.add_argument('--seed', type=int, default=1, help="Зерно генератора")
+    parser.add_argument('--dsn', help="DSN тестовой базы PostgreSQL для сравнения всех движков")
+    args = parser.parse_args()
+
+    series = generate_series(args.stations, args.points, seed=args.seed)
+    starts, ends = generate_events(args.events, seed=args.seed)
+    series_rows = args.stations * args.points
+    failures = []
+
+    print(f"Ряды: {args.stations} станций x {args.points} точек, событий: {args.events}")
+
+    print("\nФункции поиска пропусков:")
+    reference, elapsed, peak = measure(python_series_gaps, series)
+    report('python', series_rows, elapsed, peak)
+    result, elapsed, peak = measure(numpy_series_gaps, series)
+    report('numpy', series_rows, elapsed, peak)
+    check("numpy: диапазоны пропусков совпадают с python", result == reference, failures)
+    result, elapsed, peak = measure(stream_series_gaps, series)
+    report('stream', series_rows, elapsed, peak)
+    check("stream: диапазоны пропусков совпадают с python", result == reference, failures)
+
+    print("\nАнализ через SQLite-заменитель соединения:")
+    conn = SQLiteConnection()
+    conn.load_series(SERIES_TABLE, series)
+    conn.load_events(EVENTS_TABLE, starts, ends)
+    result, elapsed, peak = measure(health_check.analyze_time_series, conn, SERIES_TABLE, 'date', 'station_id')
+    report('analyze_time_series', series_rows, elapsed, peak)
+    check("analyze_time_series: диапазоны совпадают с функциями",
+          report_ranges(result) == [(a.strftime('%d.%m.%Y'), b.strftime('%d.%m.%Y')) for a, b in reference],
+          failures)
+    result, elapsed, peak = measure(health_check.analyze_event_table, conn, EVENTS_TABLE, 'start', 'end')
+    report('analyze_event_table', args.events, elapsed, peak)
+    check("analyze_event_table: диапазоны совпадают с numpy",
+          report_ranges(result) == numpy_event_ranges(starts, ends), failures)
+    conn.close()
+
+    if args.dsn:
+        run_postgres(args.dsn, series, starts, ends, series_rows, failures)
+
+    if failures:
+        print(f"\nРасхождений: {len(failures)}")
+        sys.exit(1)
+    print("\nВсе реализации дали одинаковые результаты")
+
+
+if __name__ == '__main__':
+    main()
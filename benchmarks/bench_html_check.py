@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк tests/html_check.py на локальных заменителях HTTP- и FTP-серверов.
+
+Генерирует синтетическое дерево Parsers/parsers, поднимает заменители из
+standin_servers и запускает html_check.main() целиком: без кеша, с холодным и с
+тёплым кешем. Для каждого прогона выводятся время, ссылок в секунду, пик открытых
+клиентом сокетов, число принятых серверами соединений и пик памяти по tracemalloc
+(он замеряется повторным прогоном, как в bench_health_check). Статусы в отчёте
+сверяются с ожидаемыми для каждого пути заменителя.
+"""
+
+import io
+import os
+import re
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from contextlib import redirect_stdout
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(BENCH_DIR, '..', 'tests')))
+
+import html_check
+from standin_servers import StandinServers
+
+REPORT_ROW_RE = re.compile(r"Парсер: (\S+)\n\s+Ссылка: (\S+)\n\s+Статус: (\S+)")
+SOCKET_SAMPLE_INTERVAL = 0.005
+
+PARSER_TEMPLATE = '''"""Синтетический парсер {name}"""
+import requests
+
+BUILD_BASE = "{build_base}"
+URLS = [
+{urls}
+]
+
+
+def build_url(since, until, step="1d"):
+    start = since.strftime("%Y-%m-%d")
+    return f"{{BUILD_BASE}}?from={{start}}&to={{until:%Y-%m-%d}}&step={{step}}"
+
+
+def fetch():
+    return [requests.get(url) for url in URLS]
+'''
+BUILD_QUERY = "?from=2023-01-01&to=2023-01-02&step=1d"
+
+
+def make_url(rng, servers, args, path, ftp=True):
+    "Случайная ссылка на заменитель и ожидаемый результат проверки"
+    http_base = rng.choice(servers.http_bases)
+    kinds = [
+        (args.hang_rate, lambda: (f"{http_base}/hang/{path}", False)),
+        (args.fail_rate, lambda: (f"{http_base}/status/{rng.choice((404, 500, 503))}/{path}", False)),
+        (args.big_rate, lambda: (f"{http_base}/{rng.choice(('big', 'bigfull'))}/{args.big_size}/{path}", True)),
+        (args.nohead_rate, lambda: (f"{http_base}/nohead/{path}", True)),
+    ]
+    if ftp and servers.ftp_bases:
+        kinds.append((args.ftp_rate, lambda: (f"{rng.choice(servers.ftp_bases)}/pub/{path}.dat", True)))
+    if ftp and servers.hanging_ftp_bases:
+        kinds.append((args.hang_rate, lambda: (f"{rng.choice(servers.hanging_ftp_bases)}/pub/{path}.dat", False)))
+    r = rng.random()
+    for rate, make in kinds:
+        if r < rate:
+            return make()
+        r -= rate
+    return f"{http_base}/ok/{path}", True
+
+
+def make_entry(rng, servers, args, path):
+    "Выражение для parser.py, ссылка, которую из него должен извлечь html_check, и ожидаемый статус"
+    url, ok = make_url(rng, servers, args, path)
+    style = 'const' if url.startswith('ftp://') else rng.choice(('const', 'fstring', 'template'))
+    if style == 'fstring':
+        return f'f"{url}?station={{station_iaga}}"', f"{url}?station=TEST", ok
+    if style == 'template':
+        return f'"{url}?from={{start_date}}&to={{end_date}}"', f"{url}?from=2025-07-01&to=2025-07-09", ok
+    return f'"{url}"', url, ok
+
+
+def generate_parsers_tree(root, servers, args):
+    """Пишет root/Parsers/parsers/<имя>/parser.py и возвращает папку и ожидаемый отчёт.
+
+    Отчёт - словарь (парсер, ссылка) -> 'OK'/'FAIL'. Доля args.shared ссылок берётся
+    из общего пула, поэтому одни и те же адреса встречаются в разных парсерах.
+    """
+    rng = random.Random(args.seed)
+    parsers_dir = os.path.join(root, 'Parsers', 'parsers')
+    pool = [make_entry(rng, servers, args, f"shared/{i}") for i in range(max(1, args.parsers * args.urls // 10))]
+    expected = {}
+    for index in range(args.parsers):
+        name = f"parser_{index:04d}"
+        entries = {}
+        for number in range(args.urls):
+            entry = rng.choice(pool) if rng.random() < args.shared else \
+                make_entry(rng, servers, args, f"{name}/{number}")
+            entries[entry[1]] = entry
+        build_base, ok = make_url(rng, servers, args, f"{name}/build", ftp=False)
+        entries[build_base + BUILD_QUERY] = (None, build_base + BUILD_QUERY, ok)
+
+        os.makedirs(os.path.join(parsers_dir, name), exist_ok=True)
+        with open(os.path.join(parsers_dir, name, 'parser.py'), 'w', encoding='utf-8') as f:
+            f.write(PARSER_TEMPLATE.format(
+                name=name, build_base=build_base,
+                urls="\n".join(f"    {expr}," for expr, _, _ in entries.values() if expr)))
+        for url, (_, _, ok) in entries.items():
+            expected[(name, url)] = 'OK' if ok else 'FAIL'
+    return parsers_dir, expected
+
+
+def count_sockets():
+    "Число открытых процессом сокетов; None, если /proc недоступен"
+    try:
+        fds = os.listdir('/proc/self/fd')
+    except OSError:
+        return None
+    count = 0
+    for fd in fds:
+        try:
+            if os.readlink(f'/proc/self/fd/{fd}').startswith('socket:'):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+class SocketSampler(threading.Thread):
+    "Фоновый замер пика открытых сокетов сверх уровня на момент старта"
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.baseline = count_sockets()
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        if self.baseline is None:
+            return
+        while not self.stopped.wait(SOCKET_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, count_sockets() - self.baseline)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if self.baseline is None:
+            return None, None
+        return self.peak, count_sockets() - self.baseline
+
+
+def run_main(servers, argv):
+    "Один прогон html_check.main(): текст отчёта, время, пик сокетов, оставшиеся сокеты, соединения"
+    out = io.StringIO()
+    sampler = SocketSampler()
+    sampler.start()
+    connections = servers.connections()
+    started = time.perf_counter()
+    with redirect_stdout(out):
+        html_check.main(argv)
+    elapsed = time.perf_counter() - started
+    peak_sockets, left_sockets = sampler.stop()
+    return out.getvalue(), elapsed, peak_sockets, left_sockets, servers.connections() - connections
+
+
+def measure(servers, setup, argv):
+    setup()
+    result = run_main(servers, argv)
+    setup()
+    tracemalloc.start()
+    run_main(servers, argv)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak
+
+
+def report(name, urls, elapsed, peak_sockets, left_sockets, connections, peak):
+    sockets = 'н/д' if peak_sockets is None else f"{peak_sockets} ({left_sockets})"
+    print(f"  {name:<16} {elapsed:8.3f} с {urls / elapsed if elapsed else 0:10,.0f} ссылок/с "
+          f"{sockets:>10} сокетов {connections:7} соединений {peak / 1024 / 1024:7.1f} МБ")
+
+
+def check(name, ok, failures):
+    print(f"  {name:<60} {'OK' if ok else 'РАСХОЖДЕНИЕ'}")
+    if not ok:
+        failures.append(name)
+
+
+def remove(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк html_check на локальных заменителях серверов")
+    parser.add_argument('--parsers', type=int, default=200, help="Число парсеров")
+    parser.add_argument('--urls', type=int, default=10, help="Ссылок на парсер")
+    parser.add_argument('--shared', type=float, default=0.3, help="Доля ссылок из общего для парсеров пула")
+    parser.add_argument('--http-hosts', type=int, default=8, help="Число HTTP-заменителей")
+    parser.add_argument('--ftp-hosts', type=int, default=2, help="Число FTP-заменителей")
+    parser.add_argument('--hanging-ftp-hosts', type=int, default=1, help="Число зависающих FTP-заменителей")
+    parser.add_argument('--latency', type=float, default=0.01, help="Задержка ответа сервера, с")
+    parser.add_argument('--fail-rate', type=float, default=0.1, help="Доля ссылок с кодами 404/500/503")
+    parser.add_argument('--big-rate', type=float, default=0.05, help="Доля ссылок на большие тела")
+    parser.add_argument('--big-size', type=int, default=10 * 1024 * 1024, help="Размер большого тела, байт")
+    parser.add_argument('--nohead-rate', type=float, default=0.05, help="Доля ссылок без поддержки HEAD")
+    parser.add_argument('--ftp-rate', type=float, default=0.05, help="Доля FTP-ссылок")
+    parser.add_argument('--hang-rate', type=float, default=0.002, help="Доля зависающих ссылок")
+    parser.add_argument('--timeout', type=float, default=2, help="REQUEST_TIMEOUT html_check, с")
+    parser.add_argument('--workers', type=int, default=html_check.MAX_WORKERS, help="MAX_WORKERS html_check")
+    parser.add_argument('--host-interval', type=float, default=0, help="--host-interval html_check, с")
+    parser.add_argument('--seed', type=int, default=1, help="Зерно генератора")
+    parser.add_argument('--keep', help="Папка для дерева парсеров, индекса и кеша вместо временной")
+    args = parser.parse_args()
+
+    html_check.LOCAL_URL_PATTERN = re.compile(r'$^')
+    html_check.REQUEST_TIMEOUT = args.timeout
+    html_check.MAX_WORKERS = args.workers
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            StandinServers(args.http_hosts, args.ftp_hosts, args.hanging_ftp_hosts, args.latency,
+                           hang=args.timeout + 5) as servers:
+        root = args.keep or tmp
+        html_check.PARSERS_DIR, expected = generate_parsers_tree(root, servers, args)
+        urls = len({url for _, url in expected})
+        index_file = os.path.join(root, 'html_check_index.json')
+        cache_file = os.path.join(root, 'html_check_cache.sqlite3')
+        common = ['--index-file', index_file, '--host-interval', str(args.host_interval)]
+
+        print(f"Парсеров: {args.parsers}, строк отчёта: {len(expected)}, уникальных ссылок: {urls}, "
+              f"хостов: {args.http_hosts} HTTP + {args.ftp_hosts + args.hanging_ftp_hosts} FTP, "
+              f"задержка {args.latency} с")
+        print("\nПолный прогон main() (сокеты: пик и открытые после прогона):")
+        scenarios = [
+            ('без кеша', lambda: remove(index_file), ['--no-cache', '--reindex']),
+            ('холодный кеш', lambda: remove(index_file, cache_file), ['--cache-file', cache_file]),
+            ('тёплый кеш', lambda: None, ['--cache-file', cache_file]),
+        ]
+        for name, setup, argv in scenarios:
+            (text, elapsed, peak_sockets, left_sockets, connections), peak = measure(servers, setup, argv + common)
+            report(name, urls, elapsed, peak_sockets, left_sockets, connections, peak)
+            rows = {(parser_name, url): status for parser_name, url, status in REPORT_ROW_RE.findall(text)}
+            check(f"{name}: статусы в отчёте совпадают с ожидаемыми", rows == expected, failures)
+
+    if failures:
+        print(f"\nРасхождений: {len(failures)}")
+        sys.exit(1)
+    print("\nВсе статусы совпали с ожидаемыми")
+
+
+if __name__ == '__main__':
+    main()
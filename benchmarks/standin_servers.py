@@ -0,0 +1,162 @@
+"""
+Локальные заменители HTTP- и FTP-серверов поставщиков данных для бенчмарка html_check.
+
+Серверы работают в отдельном процессе, чтобы их потоки и сокеты не попадали в замеры
+клиента. Пути HTTP-заменителя:
+
+    /ok/...              200
+    /status/<код>/...    ответ с указанным кодом
+    /nohead/...          405 на HEAD, 200 на GET
+    /big/<байт>/...      405 на HEAD, на GET с Range - 206 и один байт
+    /bigfull/<байт>/...  405 на HEAD, GET отдаёт всё тело, не глядя на Range
+    /hang/...            ответ через hang секунд
+
+FTP-заменитель понимает только команды управляющего соединения (USER, PASS, NOOP,
+QUIT); «зависший» FTP-сервер принимает соединение и молчит. Ко всем ответам
+добавляется задержка latency секунд.
+"""
+
+import time
+import threading
+import socketserver
+import multiprocessing
+import http.server
+
+BODY_CHUNK = 64 * 1024
+
+
+class CountingMixIn:
+    "Считает принятые соединения в общем для процессов счётчике"
+
+    def process_request(self, request, client_address):
+        with self.connections.get_lock():
+            self.connections.value += 1
+        super().process_request(request, client_address)
+
+
+class HTTPServer(CountingMixIn, socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class FTPServer(CountingMixIn, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+
+class HTTPHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, code, size):
+        self.send_response(code)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        chunk = b'x' * min(size, BODY_CHUNK)
+        try:
+            while size > 0:
+                self.wfile.write(chunk[:size])
+                size -= len(chunk)
+        except OSError:
+            # Клиент закрыл соединение, не дочитав тело
+            self.close_connection = True
+
+    def respond(self):
+        time.sleep(self.server.latency)
+        parts = self.path.split('/')
+        kind = parts[1] if len(parts) > 1 else ''
+        if kind == 'hang':
+            time.sleep(self.server.hang)
+            self.send_body(200, 1)
+        elif kind == 'status':
+            self.send_body(int(parts[2]), 0)
+        elif kind in ('nohead', 'big', 'bigfull') and self.command == 'HEAD':
+            self.send_body(405, 0)
+        elif kind == 'big' and 'Range' in self.headers:
+            self.send_body(206, 1)
+        elif kind in ('big', 'bigfull'):
+            self.send_body(200, int(parts[2]))
+        elif kind in ('ok', 'nohead'):
+            self.send_body(200, 1)
+        else:
+            self.send_body(404, 0)
+
+    do_HEAD = respond
+    do_GET = respond
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if self.server.hang_forever:
+            time.sleep(self.server.hang)
+            return
+        time.sleep(self.server.latency)
+        self.wfile.write(b'220 Stand-in FTP server\r\n')
+        for line in self.rfile:
+            command = line.split(b' ', 1)[0].strip().upper()
+            time.sleep(self.server.latency)
+            if command == b'QUIT':
+                self.wfile.write(b'221 Bye\r\n')
+                return
+            elif command == b'USER':
+                self.wfile.write(b'331 Password required\r\n')
+            elif command == b'PASS':
+                self.wfile.write(b'230 Logged in\r\n')
+            elif command == b'NOOP':
+                self.wfile.write(b'200 OK\r\n')
+            else:
+                self.wfile.write(b'502 Not implemented\r\n')
+
+
+def make_server(server_class, handler, connections, latency, hang, hang_forever=False):
+    server = server_class(('127.0.0.1', 0), handler)
+    server.connections = connections
+    server.latency = latency
+    server.hang = hang
+    server.hang_forever = hang_forever
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve(http_hosts, ftp_hosts, hanging_ftp_hosts, latency, hang, ports, connections):
+    servers = [make_server(HTTPServer, HTTPHandler, connections, latency, hang) for _ in range(http_hosts)]
+    servers += [make_server(FTPServer, FTPHandler, connections, latency, hang) for _ in range(ftp_hosts)]
+    servers += [make_server(FTPServer, FTPHandler, connections, latency, hang, hang_forever=True)
+                for _ in range(hanging_ftp_hosts)]
+    ports.put([server.server_address[1] for server in servers])
+    threading.Event().wait()
+
+
+class StandinServers:
+    """Запускает заменители в дочернем процессе.
+
+    После входа в контекст доступны базовые адреса http_bases, ftp_bases и
+    hanging_ftp_bases, а connections() возвращает число принятых соединений.
+    """
+
+    def __init__(self, http_hosts=8, ftp_hosts=2, hanging_ftp_hosts=1, latency=0.0, hang=30.0):
+        self.args = (http_hosts, ftp_hosts, hanging_ftp_hosts, latency, hang)
+        self.http_bases = self.ftp_bases = self.hanging_ftp_bases = []
+        self._connections = multiprocessing.Value('q', 0)
+        self._process = None
+
+    def __enter__(self):
+        http_hosts, ftp_hosts = self.args[:2]
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=serve, args=self.args + (ports, self._connections),
+                                                daemon=True)
+        self._process.start()
+        ports = ports.get(timeout=30)
+        self.http_bases = [f"http://127.0.0.1:{port}" for port in ports[:http_hosts]]
+        self.ftp_bases = [f"ftp://127.0.0.1:{port}" for port in ports[http_hosts:http_hosts + ftp_hosts]]
+        self.hanging_ftp_bases = [f"ftp://127.0.0.1:{port}" for port in ports[http_hosts + ftp_hosts:]]
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.join()
+
+    def connections(self):
+        return self._connections.value
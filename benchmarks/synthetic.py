@@ -0,0 +1,115 @@
+"""
+Генератор синтетических рядов и событий для бенчмарков health_check, а также
+SQLite-заменитель соединения psycopg2 для запуска анализа без PostgreSQL.
+"""
+
+import datetime
+import sqlite3
+
+import numpy as np
+
+EPOCH = datetime.datetime(1970, 1, 1)
+START = datetime.datetime(2020, 1, 1)
+
+
+def to_datetime(us):
+    return EPOCH + datetime.timedelta(microseconds=int(us))
+
+
+def generate_series(stations=20, points=50000, cadence=60, jitter=0.2, gap_rate=0.001,
+                    duplicate_rate=0.001, seed=1):
+    """Ряды по станциям: эпоха в микросекундах, шаг с разбросом, вставленные пропуски и дубли."""
+    rng = np.random.default_rng(seed)
+    start_us = int((START - EPOCH).total_seconds()) * 1000000
+    series = {}
+    for index in range(stations):
+        steps = np.rint(cadence * (1 + rng.uniform(-jitter, jitter, points))).astype(np.int64) * 1000000
+        gaps = rng.random(points) < gap_rate
+        steps[gaps] *= rng.integers(4, 1000, size=int(gaps.sum()))
+        steps[rng.random(points) < duplicate_rate] = 0
+        series[f"ST{index:03d}"] = start_us + np.cumsum(steps)
+    return series
+
+
+def generate_events(count=20000, mean_gap=1800, mean_length=600, overlap_rate=0.1, gap_rate=0.002, seed=1):
+    """События (начало, конец) в микросекундах: часть перекрывается, часть разделена длинными паузами."""
+    rng = np.random.default_rng(seed)
+    start_us = int((START - EPOCH).total_seconds()) * 1000000
+    lengths = rng.integers(1, mean_length * 2, count) * 1000000
+    pauses = rng.integers(1, mean_gap * 2, count) * 1000000
+    overlaps = rng.random(count) < overlap_rate
+    pauses[overlaps] = -rng.integers(0, mean_length, int(overlaps.sum())) * 1000000
+    long_gaps = rng.random(count) < gap_rate
+    pauses[long_gaps] *= 50
+    starts = np.empty(count, dtype=np.int64)
+    ends = np.empty(count, dtype=np.int64)
+    prev_end = start_us
+    prev_start = start_us - 1
+    for i in range(count):
+        starts[i] = max(prev_end + pauses[i], prev_start + 1000000)
+        ends[i] = starts[i] + lengths[i]
+        prev_start, prev_end = starts[i], ends[i]
+    return starts, ends
+
+
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, query, params=None):
+        self._cursor.execute(query.replace('%s', '?'), params or ())
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class SQLiteConnection:
+    """Минимальная часть интерфейса psycopg2-соединения поверх SQLite в памяти.
+
+    Таблицы создаются в прикреплённой базе "public", так что запросы вида
+    '"public"."table"' из health_check работают без изменений.
+    """
+
+    def __init__(self):
+        sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+        sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.datetime.fromisoformat(raw.decode()))
+        self._db = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+        self._db.execute("ATTACH DATABASE ':memory:' AS public")
+
+    def cursor(self, name=None):
+        return SQLiteCursor(self._db.cursor())
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        self._db.rollback()
+
+    def close(self):
+        self._db.close()
+
+    def load_series(self, table, series):
+        self._db.execute(f'CREATE TABLE public."{table}" (station_id TEXT, date TIMESTAMP)')
+        self._db.executemany(
+            f'INSERT INTO public."{table}" VALUES (?, ?)',
+            ((station, to_datetime(us)) for station, values in series.items() for us in values))
+        self._db.commit()
+
+    def load_events(self, table, starts, ends):
+        self._db.execute(f'CREATE TABLE public."{table}" (start TIMESTAMP, "end" TIMESTAMP)')
+        self._db.executemany(
+            f'INSERT INTO public."{table}" VALUES (?, ?)',
+            ((to_datetime(s), to_datetime(e)) for s, e in zip(starts, ends)))
+        self._db.commit()
@@ -156,6 +156,61 @@ local function exec_cmd(cmd, timeout, check_cancel)
     return result
 end
 
+local WORKER_SOCKET = os.getenv("WORKER_SOCKET") or "/tmp/tgbot-worker.sock"
+local has_unix, unix = pcall(require, "socket.unix")
+
+-- Выполняет задачу в долгоживущем воркере (worker.py) через Unix-сокет.
+-- Возвращает nil, если воркер недоступен, чтобы вызывающий код запустил python3 сам.
+local function worker_cmd(request, timeout, check_cancel)
+    if not has_unix then
+        return nil
+    end
+    local client = (unix.stream or unix)()
+    if not client or not client:connect(WORKER_SOCKET) then
+        if client then client:close() end
+        return nil
+    end
+    log("Задача для воркера: %s", json.encode(request))
+
+    local start_time = socket.gettime()
+    local result = ""
+    local pending = nil
+    client:settimeout(0.1)
+    client:send(json.encode(request) .. "\n")
+
+    while true do
+        local line, err, partial = client:receive("*l", pending)
+        pending = partial
+        if line then
+            local ok, msg = pcall(json.decode, line)
+            if ok and msg.type == "line" then
+                result = result .. fix_encoding(msg.text) .. "\n"
+            elseif ok and msg.type == "done" then
+                break
+            end
+        elseif err ~= "timeout" then
+            break
+        end
+
+        if check_cancel and check_cancel() then
+            log("Команда отменена пользователем")
+            client:send('{"type":"cancel"}\n')
+            result = result .. "\n[ПРЕРВАНО: Отменено пользователем]"
+            break
+        end
+
+        if timeout and (socket.gettime() - start_time) > timeout then
+            log("Превышен таймаут выполнения команды")
+            client:send('{"type":"cancel"}\n')
+            result = result .. "\n[ПРЕРВАНО: Превышен таймаут]"
+            break
+        end
+    end
+
+    client:close()
+    return result
+end
+
 local function list_python_files_in_tests()
     local test_dir = script_path .. "tests/"
     local files = {}
@@ -225,7 +280,8 @@ local function on_callback_query(callback, chat_id)
                 return running_commands[chat_id] and running_commands[chat_id].cancel
             end
 
-            local res = exec_cmd('python3 "' .. script_file .. '"', 300, check_cancel)
+            local res = worker_cmd({job = "script", name = (script_name:gsub("%.py$", ""))}, 300, check_cancel)
+                or exec_cmd('python3 "' .. script_file .. '"', 300, check_cancel)
 
             if running_commands[chat_id] and running_commands[chat_id].cancel then
                 safe_send(chat_id, "❌ Выполнение скрипта отменено")
@@ -377,10 +433,24 @@ local function on_message(message)
         end
 
         safe_send(chat_id, "🔌 Проверка подключения к БД...")
-        local res = exec_cmd('python3 "' .. health_check_path .. '" dbconn', 15, nil)
+        local res = worker_cmd({job = "health_check", args = {"dbconn"}}, 15, nil)
+            or exec_cmd('python3 "' .. health_check_path .. '" dbconn', 15, nil)
         safe_send(chat_id, "🔌 Результат проверки подключения к БД:\n" .. res, true)
         return
 
+    elseif text == "/checkfresh" then
+        local health_check_path = script_path .. "health_check.py"
+        if not file_exists(health_check_path) then
+            safe_send(chat_id, "❌ Скрипт проверки данных не найден")
+            return
+        end
+
+        safe_send(chat_id, "🕒 Проверка поступления данных...")
+        local res = worker_cmd({job = "health_check", args = {"fresh"}}, 60, nil)
+            or exec_cmd('python3 "' .. health_check_path .. '" fresh', 60, nil)
+        safe_send(chat_id, "🕒 Свежесть данных:\n" .. res, true)
+        return
+
     elseif text == "/checkdata" then
         local health_check_path = script_path .. "health_check.py"
         if not file_exists(health_check_path) then
@@ -401,7 +471,8 @@ local function on_message(message)
             return running_commands[chat_id] and running_commands[chat_id].cancel
         end
 
-        local res = exec_cmd('python3 "' .. health_check_path .. '" data', 300, check_cancel)
+        local res = worker_cmd({job = "health_check", args = {"data", "--budget", "270"}}, 300, check_cancel)
+            or exec_cmd('python3 "' .. health_check_path .. '" data --budget 270', 300, check_cancel)
 
         if running_commands[chat_id] and running_commands[chat_id].cancel then
             safe_send(chat_id, "❌ Анализ данных отменен")
@@ -416,6 +487,7 @@ local function on_message(message)
             "/scripts - список скриптов\n" ..
             "/checkdbconn - проверка подключения к БД\n" ..
             "/checkdata - анализ данных на пропуски\n" ..
+            "/checkfresh - поступают ли новые данные\n" ..
             "/stop - отменить выполнение")
         return
     else
@@ -1,34 +1,263 @@
 #!/usr/bin/env python3
+import os
 import sys
+import json
+import time
+import threading
+import contextlib
+import tracemalloc
 import psycopg2
+import psycopg2.extensions
 import datetime
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 DB_DSN = "dbname=parser_db user=parser_user password=S3cureP@ssw0rd host=localhost port=5432"
 SCHEMA = 'public'
 DATE_CANDIDATES = ['date', 'datetime', 'dt', 'time_tag']
 STATION_CANDIDATES = ['station_id', 'magstation_id', 'iaga_code', 'name', 'id', 'channel']
 EVENT_START_CANDIDATES = ['start', 'begin']
 EVENT_END_CANDIDATES = ['end', 'stop', 'finish']
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_check_state.json')
+SCHEMA_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'health_check_schema.json')
+INCREMENTAL_OVERLAP = 3600
+# Сколько разных интервалов между точками хранить на станцию для --incremental; станция
+# с более нерегулярными данными перечитывается целиком при каждом запуске
+INCREMENTAL_MAX_INTERVALS = 10000
+FRESHNESS_MAX_LAG = 86400
+STREAM_ITERSIZE = 10000
+COPY_PARSE_CHUNK = 4 * 1024 * 1024
+APPROX_SAMPLE_ROWS = 100000
+APPROX_MIN_DELTAS = 30
+APPROX_NOTE = "? - пропуск найден по оценке интервала из выборки, достоверность низкая\n"
+
+# Профиль запуска для --format json / --profile (таблица -> метрики) создаётся в main и
+# передаётся явно; здесь только стек открытых записей текущего потока.
+_profile_local = threading.local()
+
+def profile_add(key, value):
+    stack = getattr(_profile_local, 'stack', None)
+    if stack:
+        stack[-1][key] = stack[-1].get(key, 0) + value
+
+def profile_set(key, value):
+    stack = getattr(_profile_local, 'stack', None)
+    if stack:
+        stack[-1][key] = value
+
+@contextlib.contextmanager
+def profiled(record):
+    if record is None:
+        yield None
+        return
+    stack = getattr(_profile_local, 'stack', None)
+    if stack is None:
+        stack = _profile_local.stack = []
+    # Пик памяти - по tracemalloc и только для записей запуска с --trace-memory: перед
+    # вложенной записью пик внешней запоминается, и счётчик пика сбрасывается. При
+    # параллельном разборе таблиц (--workers) пики потоков смешиваются.
+    tracing = record.get('_trace_memory', False) and tracemalloc.is_tracing()
+    if tracing:
+        if stack:
+            stack[-1]['_peak'] = max(stack[-1].get('_peak', 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['total_time'] = record.get('total_time', 0) + time.perf_counter() - started
+        stack.pop()
+        if tracing:
+            peak = max(record.pop('_peak', 0), tracemalloc.get_traced_memory()[1])
+            record['peak_memory_kb'] = max(record.get('peak_memory_kb', 0), (peak - base) // 1024)
+            if stack:
+                stack[-1]['_peak'] = max(stack[-1].get('_peak', 0), peak)
+
+def profile_table(profile, table):
+    return profiled(profile[table] if profile is not None else None)
+
+def profile_station(station_id):
+    # Запись станции вкладывается в открытую в этом потоке запись таблицы.
+    stack = getattr(_profile_local, 'stack', None)
+    if not stack or 'stations' not in stack[-1]:
+        return profiled(None)
+    record = {'station': station_id, '_trace_memory': stack[-1].get('_trace_memory', False)}
+    stack[-1]['stations'].append(record)
+    return profiled(record)
+
+def in_profile(record, func, *func_args):
+    "Запускает func в потоке пула так, что её записи профиля вкладываются в record"
+    _profile_local.stack = [record] if record is not None else []
+    try:
+        return func(*func_args)
+    finally:
+        _profile_local.stack = []
+
+class ProfilingCursor(psycopg2.extensions.cursor):
+    # Курсор, который учитывает время запросов и число полученных строк в текущем профиле.
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            profile_add('query_time', time.perf_counter() - started)
+            profile_add('queries', 1)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            profile_add('query_time', time.perf_counter() - started)
+            profile_add('queries', 1)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        profile_add('query_time', time.perf_counter() - started)
+        if row is not None:
+            profile_add('rows', 1)
+        return row
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        profile_add('query_time', time.perf_counter() - started)
+        profile_add('rows', len(rows))
+        return rows
 
-def get_tables(conn, schema=SCHEMA):
+    def __iter__(self):
+        rows = super().__iter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                profile_add('query_time', time.perf_counter() - started)
+            profile_add('rows', 1)
+            yield row
+
+class BudgetExceeded(Exception):
+    pass
+
+# Срок окончания бюджета времени (--budget) для запросов текущего потока
+_budget_local = threading.local()
+
+@contextlib.contextmanager
+def time_budget(deadline):
+    _budget_local.deadline = deadline
+    try:
+        yield
+    finally:
+        _budget_local.deadline = None
+
+def check_budget():
+    "Остаток бюджета в секундах, None без бюджета; BudgetExceeded, если время вышло"
+    deadline = getattr(_budget_local, 'deadline', None)
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise BudgetExceeded()
+    return remaining
+
+def set_statement_timeout(conn, seconds):
+    # SET действует на все запросы сессии, в том числе COPY движка numpy и FETCH
+    # серверных курсоров; None возвращает значение по умолчанию.
+    with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+        if seconds is None:
+            cur.execute('RESET statement_timeout')
+        else:
+            cur.execute('SET statement_timeout = %s', (max(1, int(seconds * 1000)),))
+
+def get_schema_fingerprint(conn, schema=SCHEMA):
+    # Дешёвый отпечаток схемы только по pg_class: создание и удаление таблицы или индекса
+    # меняют число строк, а ADD COLUMN, смена типа с перезаписью таблицы и переименование
+    # таблицы обновляют её строку (новый xmin). Каталог колонок не читается, поэтому
+    # RENAME COLUMN и DROP COLUMN отпечаток не меняют - после них нужен --refresh-schema.
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT table_name
-            FROM information_schema.tables
-            WHERE table_schema = %s
-              AND table_type = 'BASE TABLE'
-            ORDER BY table_name
+            SELECT count(*), coalesce(max(c.xmin::text::bigint), 0)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'p', 'i')
         """, (schema,))
-        return [row[0] for row in cur.fetchall()]
+        count, max_xmin = cur.fetchone()
+        return f"{count}:{max_xmin}"
 
-def get_columns(conn, table, schema=SCHEMA):
+def load_schema(conn, schema=SCHEMA):
+    # Все таблицы, колонки с типами и индексы схемы одним запросом к pg_catalog.
     with conn.cursor() as cur:
         cur.execute("""
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-        """, (schema, table))
-        return [row[0] for row in cur.fetchall()]
+            WITH tables AS (
+                SELECT c.oid, c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s
+                  AND c.relkind IN ('r', 'p')
+                  AND (pg_has_role(c.relowner, 'USAGE')
+                       OR has_table_privilege(c.oid, 'SELECT, INSERT, UPDATE, DELETE, TRUNCATE, REFERENCES, TRIGGER'))
+            )
+            SELECT t.relname, 'column', a.attname, format_type(a.atttypid, a.atttypmod), a.attnum
+            FROM tables t
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum > 0 AND NOT a.attisdropped
+            UNION ALL
+            SELECT t.relname, 'index', i.relname,
+                   array_to_string(ARRAY(
+                       SELECT ia.attname
+                       FROM unnest(x.indkey) WITH ORDINALITY k(attnum, ord)
+                       JOIN pg_attribute ia ON ia.attrelid = t.oid AND ia.attnum = k.attnum
+                       ORDER BY k.ord
+                   ), ','),
+                   0
+            FROM tables t
+            JOIN pg_index x ON x.indrelid = t.oid
+            JOIN pg_class i ON i.oid = x.indexrelid
+            ORDER BY 1, 2, 5, 3
+        """, (schema,))
+        rows = cur.fetchall()
+
+    tables = {}
+    for table, kind, name, detail, _ in rows:
+        info = tables.setdefault(table, {'columns': {}, 'indexes': {}})
+        if kind == 'column':
+            info['columns'][name] = detail
+        else:
+            info['indexes'][name] = detail.split(',') if detail else []
+    return tables
+
+def get_schema_info(conn, schema=SCHEMA, cache_file=SCHEMA_CACHE_FILE, refresh=False):
+    # План разбора таблиц берётся из кэша на диске, пока не изменился отпечаток схемы.
+    fingerprint = get_schema_fingerprint(conn, schema)
+    if not refresh and os.path.exists(cache_file):
+        try:
+            with open(cache_file, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('schema') == schema and cached.get('fingerprint') == fingerprint:
+                return cached['tables']
+        except (OSError, ValueError):
+            pass
+
+    tables = load_schema(conn, schema)
+    for info in tables.values():
+        info['plan'] = classify_columns(list(info['columns']))
+
+    # Кэш - только ускорение: если его не записать, работаем без него
+    tmp_path = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'schema': schema, 'fingerprint': fingerprint, 'tables': tables}, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_file)
+    except OSError:
+        pass
+    return tables
 
 def get_max_date(conn, table, date_col, where=None, where_val=None, schema=SCHEMA):
     with conn.cursor() as cur:
@@ -44,6 +273,131 @@ def get_max_date(conn, table, date_col, where=None, where_val=None, schema=SCHEM
         result = cur.fetchone()
         return result[0] if result else None
 
+def get_station_max_dates(conn, table, date_col, station_col, loose_scan=False, schema=SCHEMA):
+    with conn.cursor() as cur:
+        if loose_scan:
+            # Loose index scan: рекурсивно перескакиваем по индексу к следующей станции,
+            # а для каждой берём MAX(даты) отдельной пробой по индексу.
+            cur.execute(f"""
+                WITH RECURSIVE stations AS (
+                    (SELECT "{station_col}" AS station FROM "{schema}"."{table}"
+                     WHERE "{station_col}" IS NOT NULL ORDER BY "{station_col}" LIMIT 1)
+                    UNION ALL
+                    SELECT (SELECT "{station_col}" FROM "{schema}"."{table}"
+                            WHERE "{station_col}" > s.station ORDER BY "{station_col}" LIMIT 1)
+                    FROM stations s
+                    WHERE s.station IS NOT NULL
+                )
+                SELECT s.station,
+                       (SELECT MAX("{date_col}") FROM "{schema}"."{table}" WHERE "{station_col}" = s.station)
+                FROM stations s
+                WHERE s.station IS NOT NULL
+            """)
+        else:
+            cur.execute(
+                f'SELECT "{station_col}", MAX("{date_col}") FROM "{schema}"."{table}" '
+                f'WHERE "{station_col}" IS NOT NULL GROUP BY "{station_col}" ORDER BY "{station_col}"'
+            )
+        return cur.fetchall()
+
+def get_db_now(conn):
+    with conn.cursor() as cur:
+        cur.execute('SELECT now(), LOCALTIMESTAMP')
+        return cur.fetchone()
+
+def get_lag(value, db_now):
+    now, local_now = db_now
+    if isinstance(value, datetime.datetime):
+        return (now if value.tzinfo else local_now) - value
+    return local_now - datetime.datetime.combine(value, datetime.time())
+
+def format_lag(lag):
+    hours = lag.seconds // 3600
+    if lag.days:
+        return f"{lag.days} дн. {hours} ч"
+    return f"{hours} ч {lag.seconds % 3600 // 60} мин"
+
+def check_freshness(conn, table, plan, indexes, db_now, max_lag=FRESHNESS_MAX_LAG):
+    kind, first_col, second_col = plan
+    if kind == 'event':
+        date_col, station_col = second_col, None
+    else:
+        date_col, station_col = first_col, second_col
+
+    max_date = get_max_date(conn, table, date_col)
+    if max_date is None:
+        return f"{table} - нет данных.\n"
+
+    limit = datetime.timedelta(seconds=max_lag)
+    if not station_col:
+        lag = get_lag(max_date, db_now)
+        if lag > limit:
+            return f"{table} - нет новых данных {format_lag(lag)}. Последняя дата: {max_date}\n"
+        return f"{table} - данные поступают. Последняя дата: {max_date}\n"
+
+    loose_scan = any(columns and columns[0] == station_col for columns in indexes.values())
+    stale = [
+        f"{station_id} ({station_max})"
+        for station_id, station_max in get_station_max_dates(conn, table, date_col, station_col, loose_scan)
+        if station_max is not None and get_lag(station_max, db_now) > limit
+    ]
+    if stale:
+        return f"{table} - нет новых данных у станций: {', '.join(stale)}. Последняя дата: {max_date}\n"
+    return f"{table} - данные поступают. Последняя дата: {max_date}\n"
+
+class TableReport:
+    """Итог проверки таблицы: из него строится и строка текстового отчёта (str), и запись JSON.
+
+    status - 'ok', 'gaps', 'insufficient' или 'skipped'; gaps - список (начало, конец, достоверен).
+    Для 'insufficient' и 'skipped' message - причина, dated=False - строка без последней даты.
+    """
+
+    def __init__(self, table, status, gaps=(), last_date=None, message=None, dated=True):
+        self.table = table
+        self.status = status
+        self.gaps = list(gaps)
+        self.last_date = last_date
+        self.message = message
+        self.dated = dated
+
+    def __str__(self):
+        if self.status == 'gaps':
+            ranges_str = ", ".join(
+                f"({start.strftime('%d.%m.%Y')}-{end.strftime('%d.%m.%Y')}{'' if confident else ' ?'})"
+                for start, end, confident in self.gaps
+            )
+            text = f"есть пропуски {ranges_str}"
+        elif self.status == 'ok':
+            text = "пропусков нет"
+        else:
+            text = self.message
+        if not self.dated:
+            return f"{self.table} - {text}\n"
+        return f"{self.table} - {text}. Последняя дата: {self.last_date}\n"
+
+    def as_dict(self):
+        return {
+            'table': self.table,
+            'status': self.status,
+            'gap_count': len(self.gaps),
+            'gaps': [
+                {'start': start.strftime('%d.%m.%Y'), 'end': end.strftime('%d.%m.%Y'), 'confident': confident}
+                for start, end, confident in self.gaps
+            ],
+            'last_date': str(self.last_date) if self.dated and self.last_date is not None else None,
+        }
+
+def ranges_report(table, grouped, max_date):
+    "Отчёт по уже склеенным пропускам (начало, конец, ...): все они достоверны"
+    if not grouped:
+        return TableReport(table, 'ok', last_date=max_date)
+    return TableReport(table, 'gaps', [(start, end, True) for start, end, *_ in grouped], max_date)
+
+def insufficient_report(table, max_date=None, dated=True, message="недостаточно данных для анализа"):
+    if not dated:
+        return TableReport(table, 'insufficient', message=message + ".", dated=False)
+    return TableReport(table, 'insufficient', last_date=max_date, message=message)
+
 def get_event_intervals(conn, table, start_col, end_col, schema=SCHEMA):
     with conn.cursor() as cur:
         cur.execute(
@@ -85,7 +439,7 @@ def group_gaps(gaps):
 def analyze_event_table(conn, table, start_col, end_col):
     intervals = get_event_intervals(conn, table, start_col, end_col)
     if len(intervals) < 2:
-        return f"{table} - недостаточно данных для анализа.\n"
+        return insufficient_report(table, dated=False)
 
     gaps = []
     for i in range(1, len(intervals)):
@@ -100,7 +454,7 @@ def analyze_event_table(conn, table, start_col, end_col):
     max_date = max([i[1] for i in intervals if i[1] is not None], default=None)
 
     if not gaps:
-        return f"{table} - пропусков нет. Последняя дата: {max_date}\n"
+        return TableReport(table, 'ok', last_date=max_date)
 
     intervals_sorted = sorted([g[2].total_seconds() for g in gaps])
     if len(intervals_sorted) < 3:
@@ -117,13 +471,9 @@ def analyze_event_table(conn, table, start_col, end_col):
     significant_gaps = [g for g in gaps if g[2].total_seconds() > threshold]
 
     if not significant_gaps:
-        return f"{table} - пропусков нет. Последняя дата: {max_date}\n"
+        return TableReport(table, 'ok', last_date=max_date)
 
-    grouped = group_gaps(significant_gaps)
-    ranges_str = ", ".join(
-        f"({start.strftime('%d.%m.%Y')}-{end.strftime('%d.%m.%Y')})" for start, end, _ in grouped
-    )
-    return f"{table} - есть пропуски {ranges_str}. Последняя дата: {max_date}\n"
+    return ranges_report(table, group_gaps(significant_gaps), max_date)
 
 def get_distinct(conn, table, col, schema=SCHEMA):
     with conn.cursor() as cur:
@@ -151,6 +501,20 @@ def find_significant_gaps(timestamps, min_interval, factor=3):
             significant_gaps.append((timestamps[i - 1], timestamps[i], datetime.timedelta(seconds=diff)))
     return significant_gaps
 
+def analyze_station(conn, table, date_col, station_col, station_id):
+    with profile_station(station_id):
+        timestamps = get_timestamps(conn, table, date_col, where=station_col, where_val=station_id)
+        timestamps = sorted(set(timestamps))
+        if len(timestamps) < 2:
+            return None
+        min_interval = find_min_interval(timestamps)
+        if min_interval is None:
+            return None
+        profile_set('median_interval', min_interval)
+        grouped = group_gaps(find_significant_gaps(timestamps, min_interval, factor=3))
+        profile_set('gap_count', len(grouped))
+        return grouped, max(timestamps)
+
 def analyze_time_series(conn, table, date_col, station_col=None):
     all_gaps = []
 
@@ -159,18 +523,12 @@ def analyze_time_series(conn, table, date_col, station_col=None):
     if station_col:
         station_ids = get_distinct(conn, table, station_col)
         for station_id in station_ids:
-            timestamps = get_timestamps(conn, table, date_col, where=station_col, where_val=station_id)
-            timestamps = sorted(set(timestamps))
-            if len(timestamps) < 2:
-                continue
-            min_interval = find_min_interval(timestamps)
-            if min_interval is None:
+            check_budget()
+            result = analyze_station(conn, table, date_col, station_col, station_id)
+            if result is None:
                 continue
-            gaps = find_significant_gaps(timestamps, min_interval, factor=3)
-            grouped_gaps = group_gaps(gaps)
+            grouped_gaps, max_station_date = result
             all_gaps.extend(grouped_gaps)
-
-            max_station_date = max(timestamps) if timestamps else None
             if max_station_date and (max_date_overall is None or max_station_date > max_date_overall):
                 max_date_overall = max_station_date
     else:
@@ -178,25 +536,784 @@ def analyze_time_series(conn, table, date_col, station_col=None):
         timestamps = sorted(set(timestamps))
         if len(timestamps) < 2:
             max_date = max(timestamps) if timestamps else None
-            return f"{table} - недостаточно данных для анализа. Последняя дата: {max_date}\n"
+            return insufficient_report(table, max_date)
         min_interval = find_min_interval(timestamps)
         if min_interval is None:
             max_date = max(timestamps) if timestamps else None
-            return f"{table} - не удалось вычислить минимальный интервал. Последняя дата: {max_date}\n"
+            return insufficient_report(table, max_date, message="не удалось вычислить минимальный интервал")
+        profile_set('median_interval', min_interval)
         gaps = find_significant_gaps(timestamps, min_interval, factor=3)
         grouped_gaps = group_gaps(gaps)
         all_gaps.extend(grouped_gaps)
         max_date_overall = max(timestamps) if timestamps else None
 
-    if not all_gaps:
-        return f"{table} - пропусков нет. Последняя дата: {max_date_overall}\n"
+    return gaps_report(table, all_gaps, max_date_overall)
+
+def gaps_report(table, all_gaps, max_date):
+    return ranges_report(table, group_gaps(sorted(all_gaps, key=lambda x: x[0])), max_date)
+
+def get_series_gaps_sql(conn, table, date_col, station_col=None, factor=3, schema=SCHEMA):
+    # Всё считается на стороне PostgreSQL: интервалы через LAG(), медиана через
+    # percentile_cont, значимые пропуски сразу склеиваются в диапазоны по станциям.
+    if station_col:
+        station_expr = f'"{station_col}"'
+        station_filter = f'AND "{station_col}" IS NOT NULL'
+    else:
+        station_expr = '0'
+        station_filter = ''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH series AS (
+                SELECT DISTINCT {station_expr} AS station, "{date_col}" AS ts
+                FROM "{schema}"."{table}"
+                WHERE "{date_col}" IS NOT NULL {station_filter}
+            ), deltas AS (
+                SELECT station, ts,
+                       LAG(ts) OVER w AS prev_ts,
+                       EXTRACT(EPOCH FROM ts)::float8 - EXTRACT(EPOCH FROM LAG(ts) OVER w)::float8 AS delta
+                FROM series
+                WINDOW w AS (PARTITION BY station ORDER BY ts)
+            ), stats AS (
+                SELECT station, COUNT(*) AS n, MAX(ts) AS last_ts,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY delta) AS median
+                FROM deltas
+                GROUP BY station
+            ), gaps AS (
+                SELECT d.station, d.prev_ts, d.ts, d.delta,
+                       CASE WHEN d.prev_ts = LAG(d.ts) OVER (PARTITION BY d.station ORDER BY d.ts)
+                            THEN 0 ELSE 1 END AS is_new
+                FROM deltas d
+                JOIN stats s ON s.station = d.station
+                WHERE s.n >= 2 AND d.delta > s.median * %s
+            ), islands AS (
+                SELECT station, prev_ts, ts, delta,
+                       SUM(is_new) OVER (PARTITION BY station ORDER BY ts) AS grp
+                FROM gaps
+            ), grouped AS (
+                SELECT station, MIN(prev_ts) AS gap_start, MAX(ts) AS gap_end, SUM(delta) AS total
+                FROM islands
+                GROUP BY station, grp
+            ), summary AS (
+                SELECT MAX(last_ts) FILTER (WHERE n >= 2) AS max_ts,
+                       MAX(last_ts) AS max_ts_all,
+                       COUNT(*) FILTER (WHERE n >= 2) AS analyzed
+                FROM stats
+            )
+            SELECT s.max_ts, s.max_ts_all, s.analyzed, g.gap_start, g.gap_end, g.total
+            FROM summary s
+            LEFT JOIN grouped g ON true
+            ORDER BY g.gap_start, g.station
+        """, (factor,))
+        rows = cur.fetchall()
+
+    max_ts, max_ts_all, analyzed = rows[0][:3]
+    gaps = [
+        (gap_start, gap_end, datetime.timedelta(seconds=total))
+        for _, _, _, gap_start, gap_end, total in rows
+        if gap_start is not None
+    ]
+    return gaps, max_ts, max_ts_all, analyzed
+
+def analyze_time_series_sql(conn, table, date_col, station_col=None):
+    gaps, max_date, max_date_all, analyzed = get_series_gaps_sql(conn, table, date_col, station_col)
+    if not station_col and not analyzed:
+        return insufficient_report(table, max_date_all)
+    return gaps_report(table, gaps, max_date)
+
+def get_reltuples(conn, table, schema=SCHEMA):
+    with conn.cursor() as cur:
+        cur.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', (f'"{schema}"."{table}"',))
+        result = cur.fetchone()
+        return result[0] if result else -1
+
+def get_cadence(conn, table, date_col, station_col=None, sample='', stations=None, schema=SCHEMA):
+    """Медианный интервал и число интервалов по станциям: станция -> (медиана, число).
+
+    В выборке интервалы берутся только между строками одной страницы: соседние в выборке
+    строки станции с разных страниц разделены пропущенными страницами, и при чередовании
+    многих станций такой интервал во много раз длиннее настоящего. stations ограничивает
+    расчёт списком станций.
+    """
+    station_expr = f'"{station_col}"::text' if station_col else "''"
+    page_expr = '(ctid::text::point)[0]' if sample else '0'
+    conditions = [f'"{date_col}" IS NOT NULL']
+    params = []
+    if station_col:
+        conditions.append(f'"{station_col}" IS NOT NULL')
+    if stations is not None:
+        conditions.append(f'{station_expr} = ANY(%s)')
+        params.append(list(stations))
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH series AS (
+                SELECT DISTINCT {station_expr} AS station, {page_expr} AS page, "{date_col}" AS ts
+                FROM "{schema}"."{table}" {sample}
+                WHERE {" AND ".join(conditions)}
+            ), deltas AS (
+                SELECT station,
+                       EXTRACT(EPOCH FROM ts)::float8
+                       - EXTRACT(EPOCH FROM LAG(ts) OVER (PARTITION BY station, page ORDER BY ts))::float8 AS delta
+                FROM series
+            )
+            SELECT station, percentile_cont(0.5) WITHIN GROUP (ORDER BY delta), COUNT(delta)
+            FROM deltas
+            GROUP BY station
+            HAVING COUNT(delta) > 0
+        """, params)
+        return {station: (median, count) for station, median, count in cur.fetchall()}
+
+def estimate_cadence(conn, table, date_col, station_col=None, schema=SCHEMA):
+    # Медианный интервал по выборке TABLESAMPLE SYSTEM. Станции, у которых в выборке меньше
+    # APPROX_MIN_DELTAS интервалов, сюда не попадают и потом считаются точно.
+    # Небольшие таблицы читаются целиком, и оценка для них точная.
+    reltuples = get_reltuples(conn, table, schema)
+    if reltuples <= APPROX_SAMPLE_ROWS:
+        cadence = get_cadence(conn, table, date_col, station_col, schema=schema)
+        return {station: (median, True, count) for station, (median, count) in cadence.items()}
+    sample = f'TABLESAMPLE SYSTEM ({100.0 * APPROX_SAMPLE_ROWS / reltuples:.6f}) REPEATABLE (0)'
+    cadence = get_cadence(conn, table, date_col, station_col, sample, schema=schema)
+    return {station: (median, False, count) for station, (median, count) in cadence.items()
+            if count >= APPROX_MIN_DELTAS}
+
+def get_bucket_gaps(conn, table, date_col, station_col, widths, report_missing=True, schema=SCHEMA):
+    """Возвращает (последняя дата, переходы через пустые корзины, станции без интервала).
+
+    Строки раскладываются по корзинам шириной в половину порога, так что любой пропуск
+    длиннее порога накрывает хотя бы одну пустую корзину. Наружу отдаются только
+    переходы через пустые корзины, с точными датами по краям. С report_missing тем же
+    проходом собираются станции, для которых ширины нет.
+    """
+    station_expr = f't."{station_col}"::text' if station_col else "''"
+    station_filter = f'AND t."{station_col}" IS NOT NULL' if station_col else ''
+    join = 'LEFT JOIN' if report_missing else 'JOIN'
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH cadence AS (
+                SELECT * FROM unnest(%s::text[], %s::float8[]) AS c(station, width)
+            ), buckets AS (
+                SELECT {station_expr} AS station,
+                       floor(EXTRACT(EPOCH FROM t."{date_col}")::float8 / c.width)::int8 AS bucket,
+                       MIN(t."{date_col}") AS lo, MAX(t."{date_col}") AS hi
+                FROM "{schema}"."{table}" t
+                {join} cadence c ON c.station = {station_expr}
+                WHERE t."{date_col}" IS NOT NULL {station_filter}
+                GROUP BY 1, 2
+            ), steps AS (
+                SELECT station, bucket, lo,
+                       LAG(bucket) OVER w AS prev_bucket,
+                       LAG(hi) OVER w AS prev_hi
+                FROM buckets
+                WHERE bucket IS NOT NULL
+                WINDOW w AS (PARTITION BY station ORDER BY bucket)
+            ), summary AS (
+                SELECT MAX(hi) AS max_ts FROM buckets WHERE bucket IS NOT NULL
+            )
+            SELECT FALSE, m.max_ts, s.station, s.prev_hi, s.lo,
+                   EXTRACT(EPOCH FROM s.lo)::float8 - EXTRACT(EPOCH FROM s.prev_hi)::float8
+            FROM summary m
+            LEFT JOIN steps s ON s.bucket - s.prev_bucket > 1
+            UNION ALL
+            SELECT TRUE, NULL, station, NULL, NULL, NULL
+            FROM buckets
+            WHERE bucket IS NULL
+            ORDER BY 4, 3
+        """, (list(widths), list(widths.values())))
+        rows = cur.fetchall()
+    max_date = None
+    gaps = []
+    missing = []
+    for is_missing, max_ts, station, start, end, diff in rows:
+        if is_missing:
+            missing.append(station)
+            continue
+        max_date = max_ts
+        if start is not None:
+            gaps.append((station, start, end, diff))
+    return max_date, gaps, missing
+
+def group_flagged_gaps(gaps):
+    # group_gaps для пропусков с флагом достоверности: склеенный диапазон достоверен,
+    # только если достоверны все его части.
+    grouped = []
+    for start, end, total, confident in gaps:
+        if grouped and grouped[-1][1] == start:
+            prev_start, _, prev_total, prev_confident = grouped[-1]
+            grouped[-1] = (prev_start, end, prev_total + total, prev_confident and confident)
+        else:
+            grouped.append((start, end, total, confident))
+    return grouped
+
+def analyze_time_series_approx(conn, table, date_col, station_col=None, factor=3):
+    cadence = estimate_cadence(conn, table, date_col, station_col)
+    widths = {station: median * factor / 2 for station, (median, _, _) in cadence.items()}
+    max_date, gap_rows, missing = get_bucket_gaps(conn, table, date_col, station_col, widths)
+
+    if missing:
+        # Станции, которых нет в выборке или которые попали в неё слишком редко, считаются точно
+        exact = get_cadence(conn, table, date_col, station_col, stations=missing)
+        if exact:
+            cadence.update({station: (median, True, count) for station, (median, count) in exact.items()})
+            widths = {station: median * factor / 2 for station, (median, _) in exact.items()}
+            exact_max, exact_rows, _ = get_bucket_gaps(conn, table, date_col, station_col, widths,
+                                                       report_missing=False)
+            gap_rows += exact_rows
+            if max_date is None or (exact_max is not None and exact_max > max_date):
+                max_date = exact_max
+
+    if not cadence:
+        if station_col:
+            return gaps_report(table, [], None)
+        return insufficient_report(table, get_max_date(conn, table, date_col))
+
+    station_gaps = {}
+    for station, start, end, diff in gap_rows:
+        median, exact, count = cadence[station]
+        threshold = median * factor
+        if diff <= threshold:
+            continue
+        # Пропуск, лишь немного превышающий порог, мог бы исчезнуть при точной медиане.
+        confident = exact or (count >= APPROX_MIN_DELTAS and diff >= threshold * 2)
+        station_gaps.setdefault(station, []).append((start, end, datetime.timedelta(seconds=diff), confident))
+
+    all_gaps = []
+    for gaps in station_gaps.values():
+        all_gaps.extend(group_flagged_gaps(gaps))
+    grouped = group_flagged_gaps(sorted(all_gaps, key=lambda x: x[0]))
+
+    if not grouped:
+        return TableReport(table, 'ok', last_date=max_date)
+    return TableReport(table, 'gaps', [(start, end, confident) for start, end, _, confident in grouped], max_date)
+
+def iter_rows(conn, query, params=None, itersize=STREAM_ITERSIZE):
+    # Именованный (серверный) курсор: строки приходят пачками по itersize,
+    # а не целиком через fetchall().
+    with conn.cursor(name='health_check_stream') as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+
+def get_series_medians(conn, table, date_col, station_col=None, schema=SCHEMA):
+    station_expr = f'"{station_col}"' if station_col else 'NULL'
+    station_filter = f'AND "{station_col}" IS NOT NULL' if station_col else ''
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH series AS (
+                SELECT DISTINCT {station_expr} AS station, "{date_col}" AS ts
+                FROM "{schema}"."{table}"
+                WHERE "{date_col}" IS NOT NULL {station_filter}
+            ), deltas AS (
+                SELECT station,
+                       EXTRACT(EPOCH FROM ts)::float8
+                       - EXTRACT(EPOCH FROM LAG(ts) OVER (PARTITION BY station ORDER BY ts))::float8 AS delta
+                FROM series
+            )
+            SELECT station, percentile_cont(0.5) WITHIN GROUP (ORDER BY delta)
+            FROM deltas
+            GROUP BY station
+        """)
+        return dict(cur.fetchall())
+
+def iter_series(conn, table, date_col, station_col=None, schema=SCHEMA):
+    if station_col:
+        query = (f'SELECT "{station_col}", "{date_col}" FROM "{schema}"."{table}" '
+                 f'WHERE "{station_col}" IS NOT NULL AND "{date_col}" IS NOT NULL '
+                 f'ORDER BY "{station_col}", "{date_col}"')
+    else:
+        query = (f'SELECT NULL, "{date_col}" FROM "{schema}"."{table}" '
+                 f'WHERE "{date_col}" IS NOT NULL ORDER BY "{date_col}"')
+    return iter_rows(conn, query)
+
+def iter_station_gaps(rows, medians, factor=3):
+    # Один проход по упорядоченному потоку (станция, дата) с O(1) состоянием:
+    # отдаёт по каждой станции её последнюю дату, медиану и склеенные пропуски.
+    station_id = None
+    prev = None
+    threshold = None
+    gap = None
+    started = False
+    for row_station, ts in rows:
+        if not started or row_station != station_id:
+            # Между станциями сверяемся с --budget: каждый FETCH укладывается в
+            # statement_timeout, но их сумма - нет
+            check_budget()
+            if started:
+                if gap:
+                    yield 'gap', station_id, gap
+                yield 'last', station_id, prev
+            started = True
+            station_id = row_station
+            median = medians.get(station_id)
+            threshold = median * factor if median is not None else None
+            prev = None
+            gap = None
+        if prev is not None and threshold is not None and ts != prev:
+            diff = (ts - prev).total_seconds()
+            if diff > threshold:
+                if gap and gap[1] == prev:
+                    gap = (gap[0], ts, gap[2] + datetime.timedelta(seconds=diff))
+                else:
+                    if gap:
+                        yield 'gap', station_id, gap
+                    gap = (prev, ts, datetime.timedelta(seconds=diff))
+        prev = ts
+    if started:
+        if gap:
+            yield 'gap', station_id, gap
+        yield 'last', station_id, prev
+
+def analyze_time_series_stream(conn, table, date_col, station_col=None):
+    medians = get_series_medians(conn, table, date_col, station_col)
+    all_gaps = []
+    max_date_overall = None
+    max_date_all = None
+    for kind, station_id, value in iter_station_gaps(iter_series(conn, table, date_col, station_col), medians):
+        if kind == 'gap':
+            all_gaps.append(value)
+            continue
+        if max_date_all is None or value > max_date_all:
+            max_date_all = value
+        if medians.get(station_id) is not None and (max_date_overall is None or value > max_date_overall):
+            max_date_overall = value
+
+    if not station_col and max_date_overall is None:
+        return insufficient_report(table, max_date_all)
+    return gaps_report(table, all_gaps, max_date_overall)
+
+def get_event_gap_stats(conn, table, start_col, end_col, schema=SCHEMA):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            WITH diffs AS (
+                SELECT "{end_col}" AS finish,
+                       EXTRACT(EPOCH FROM "{start_col}")::float8
+                       - EXTRACT(EPOCH FROM LAG("{end_col}") OVER (ORDER BY "{start_col}", "{end_col}"))::float8 AS diff
+                FROM "{schema}"."{table}"
+                WHERE "{start_col}" IS NOT NULL AND "{end_col}" IS NOT NULL
+            )
+            SELECT COUNT(*), MAX(finish), COUNT(*) FILTER (WHERE diff > 0),
+                   MIN(diff) FILTER (WHERE diff > 0),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY diff) FILTER (WHERE diff > 0)
+            FROM diffs
+        """)
+        return cur.fetchone()
+
+def analyze_event_table_stream(conn, table, start_col, end_col, schema=SCHEMA):
+    count, max_date, gap_count, min_gap, median_gap = get_event_gap_stats(conn, table, start_col, end_col)
+    if count < 2:
+        return insufficient_report(table, dated=False)
+    if not gap_count:
+        return TableReport(table, 'ok', last_date=max_date)
+
+    min_interval = min_gap if gap_count < 3 else median_gap
+    threshold = min_interval * 3
+
+    grouped = []
+    gap = None
+    prev_end = None
+    rows = iter_rows(conn, f'SELECT "{start_col}", "{end_col}" FROM "{schema}"."{table}" '
+                           f'WHERE "{start_col}" IS NOT NULL AND "{end_col}" IS NOT NULL '
+                           f'ORDER BY "{start_col}", "{end_col}"')
+    for curr_start, curr_end in rows:
+        if prev_end is not None:
+            diff = (curr_start - prev_end).total_seconds()
+            if diff > threshold:
+                if gap and gap[1] == prev_end:
+                    gap = (gap[0], curr_start, gap[2] + datetime.timedelta(seconds=diff))
+                else:
+                    if gap:
+                        grouped.append(gap)
+                    gap = (prev_end, curr_start, datetime.timedelta(seconds=diff))
+        prev_end = curr_end
+    if gap:
+        grouped.append(gap)
+
+    return ranges_report(table, grouped, max_date)
+
+def get_column_type(conn, table, column, schema=SCHEMA):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT format_type(a.atttypid, a.atttypmod), current_setting('TimeZone')
+            FROM pg_attribute a
+            WHERE a.attrelid = %s::regclass AND a.attname = %s
+        """, (f'"{schema}"."{table}"', column))
+        return cur.fetchone()
+
+def make_epoch_converter(col_type, tz_name):
+    # Обратное преобразование микросекунд эпохи в тот же тип, который вернул бы psycopg2.
+    epoch = datetime.datetime(1970, 1, 1)
+    if col_type == 'date':
+        return lambda us: (epoch + datetime.timedelta(microseconds=int(us))).date()
+    if col_type.startswith('timestamp') and col_type.endswith('without time zone'):
+        return lambda us: epoch + datetime.timedelta(microseconds=int(us))
+    if col_type.startswith('timestamp') and col_type.endswith('with time zone'):
+        from zoneinfo import ZoneInfo
+        try:
+            tz = ZoneInfo(tz_name)
+        except Exception:
+            return None
+        epoch_utc = epoch.replace(tzinfo=datetime.timezone.utc)
+        return lambda us: (epoch_utc + datetime.timedelta(microseconds=int(us))).astimezone(tz)
+    return None
+
+class Int64ColumnsSink:
+    """Приёмник COPY ... (FORMAT binary) для copy_expert, разбирающий поток по частям.
+
+    Каждая строка - фиксированная запись из int8-полей, и numpy разбирает накопленные
+    COPY_PARSE_CHUNK байт целиком, без объектов Python на каждую строку. В памяти
+    одновременно только эта часть ответа и уже разобранные массивы.
+    """
+
+    def __init__(self, ncols):
+        fields = [('count', '>i2')]
+        for i in range(ncols):
+            fields += [(f'len{i}', '>i4'), (f'val{i}', '>i8')]
+        self.record = np.dtype(fields)
+        self.ncols = ncols
+        self.pending = bytearray()
+        self.header_done = False
+        self.parts = [[] for _ in range(ncols)]
+
+    def write(self, data):
+        # copy_expert пишет по строке за вызов, поэтому разбор - только по накоплении части
+        self.pending += data
+        if len(self.pending) >= COPY_PARSE_CHUNK:
+            self.parse()
+        return len(data)
+
+    def parse(self):
+        if not self.header_done:
+            # Заголовок: сигнатура (11 байт), флаги, длина расширения и само расширение
+            if len(self.pending) < 19:
+                return
+            header_len = 19 + int.from_bytes(self.pending[15:19], 'big')
+            if len(self.pending) < header_len:
+                return
+            del self.pending[:header_len]
+            self.header_done = True
+        count = len(self.pending) // self.record.itemsize
+        if not count:
+            return
+        records = np.frombuffer(self.pending, dtype=self.record, count=count)
+        for i in range(self.ncols):
+            self.parts[i].append(records[f'val{i}'].astype(np.int64))
+        del records
+        del self.pending[:count * self.record.itemsize]
+
+    def columns(self):
+        # После разбора остаётся только признак конца данных (два байта)
+        self.parse()
+        columns = []
+        for parts in self.parts:
+            # Части колонки освобождаются сразу после склейки, до следующей колонки
+            columns.append(np.concatenate(parts) if parts else np.empty(0, dtype=np.int64))
+            parts.clear()
+        return columns
+
+def fetch_int64_columns(conn, query, ncols):
+    sink = Int64ColumnsSink(ncols)
+    with conn.cursor() as cur:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", sink)
+    columns = sink.columns()
+    profile_add('rows', len(columns[0]))
+    return columns
+
+def np_median_seconds(intervals_us):
+    return float(np.median(intervals_us.astype(np.float64) / 1e6))
+
+def np_group_gaps(gap_start, gap_end, gap_total):
+    # Аналог group_gaps: пропуск продолжает предыдущий, если начинается там, где тот кончился.
+    if not len(gap_start):
+        return gap_start, gap_end, gap_total
+    new_group = np.ones(len(gap_start), dtype=bool)
+    new_group[1:] = gap_start[1:] != gap_end[:-1]
+    firsts = np.flatnonzero(new_group)
+    lasts = np.append(firsts[1:] - 1, len(gap_start) - 1)
+    return gap_start[firsts], gap_end[lasts], np.add.reduceat(gap_total, firsts)
+
+def np_series_gaps(station_idx, ts_us, factor=3):
+    # station_idx и ts_us отсортированы по (станция, время). Возвращает склеенные
+    # пропуски по станциям и последние даты станций, где хватило данных для анализа.
+    if len(ts_us):
+        keep = np.ones(len(ts_us), dtype=bool)
+        keep[1:] = (station_idx[1:] != station_idx[:-1]) | (ts_us[1:] != ts_us[:-1])
+        station_idx, ts_us = station_idx[keep], ts_us[keep]
+
+    bounds = np.flatnonzero(np.diff(station_idx)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(ts_us)]))
+    deltas = np.diff(ts_us)
+
+    gap_starts, gap_ends, gap_totals, last_dates = [], [], [], []
+    for lo, hi in zip(starts, ends):
+        if hi - lo < 2:
+            continue
+        station_deltas = deltas[lo:hi - 1]
+        threshold = np_median_seconds(station_deltas) * factor
+        gap_idx = np.flatnonzero(station_deltas.astype(np.float64) / 1e6 > threshold) + lo
+        grouped = np_group_gaps(ts_us[gap_idx], ts_us[gap_idx + 1], deltas[gap_idx])
+        gap_starts.append(grouped[0])
+        gap_ends.append(grouped[1])
+        gap_totals.append(grouped[2])
+        last_dates.append(ts_us[hi - 1])
+
+    if not last_dates:
+        empty = np.array([], dtype=np.int64)
+        return (empty, empty, empty), empty
+    return ((np.concatenate(gap_starts), np.concatenate(gap_ends), np.concatenate(gap_totals)),
+            np.array(last_dates, dtype=np.int64))
+
+def np_event_gaps(start_us, end_us, factor=3):
+    diffs = start_us[1:] - end_us[:-1]
+    positive = np.flatnonzero(diffs > 0)
+    if not len(positive):
+        return None
+    seconds = diffs[positive].astype(np.float64) / 1e6
+    min_interval = float(seconds.min()) if len(seconds) < 3 else float(np.median(seconds))
+    significant = positive[seconds > min_interval * factor]
+    return np_group_gaps(end_us[significant], start_us[significant + 1], diffs[significant])
+
+def epoch_us_expr(col):
+    return f'(EXTRACT(EPOCH FROM "{col}") * 1000000)::int8'
+
+def analyze_time_series_numpy(conn, table, date_col, station_col=None, schema=SCHEMA):
+    if np is None:
+        return analyze_time_series(conn, table, date_col, station_col)
+    convert = make_epoch_converter(*get_column_type(conn, table, date_col))
+    if convert is None:
+        return analyze_time_series(conn, table, date_col, station_col)
+
+    if station_col:
+        query = (f'SELECT DENSE_RANK() OVER (ORDER BY "{station_col}")::int8, {epoch_us_expr(date_col)} '
+                 f'FROM "{schema}"."{table}" '
+                 f'WHERE "{station_col}" IS NOT NULL AND "{date_col}" IS NOT NULL '
+                 f'ORDER BY "{station_col}", "{date_col}"')
+    else:
+        query = (f'SELECT 0::int8, {epoch_us_expr(date_col)} FROM "{schema}"."{table}" '
+                 f'WHERE "{date_col}" IS NOT NULL ORDER BY "{date_col}"')
+    station_idx, ts_us = fetch_int64_columns(conn, query, 2)
+    (gap_start, gap_end, gap_total), last_dates = np_series_gaps(station_idx, ts_us)
+
+    if not station_col and not len(last_dates):
+        max_date = convert(ts_us.max()) if len(ts_us) else None
+        return insufficient_report(table, max_date)
+
+    max_date_overall = convert(last_dates.max()) if len(last_dates) else None
+    all_gaps = [
+        (convert(a), convert(b), datetime.timedelta(microseconds=int(total)))
+        for a, b, total in zip(gap_start, gap_end, gap_total)
+    ]
+    return gaps_report(table, all_gaps, max_date_overall)
+
+def analyze_event_table_numpy(conn, table, start_col, end_col, schema=SCHEMA):
+    if np is None:
+        return analyze_event_table(conn, table, start_col, end_col)
+    convert_start = make_epoch_converter(*get_column_type(conn, table, start_col))
+    convert_end = make_epoch_converter(*get_column_type(conn, table, end_col))
+    if convert_start is None or convert_end is None:
+        return analyze_event_table(conn, table, start_col, end_col)
+
+    start_us, end_us = fetch_int64_columns(
+        conn,
+        f'SELECT {epoch_us_expr(start_col)}, {epoch_us_expr(end_col)} FROM "{schema}"."{table}" '
+        f'WHERE "{start_col}" IS NOT NULL AND "{end_col}" IS NOT NULL ORDER BY "{start_col}"',
+        2)
+    if len(start_us) < 2:
+        return insufficient_report(table, dated=False)
+
+    max_date = convert_end(end_us.max())
+    grouped = np_event_gaps(start_us, end_us)
+    if grouped is None or not len(grouped[0]):
+        return TableReport(table, 'ok', last_date=max_date)
+
+    return ranges_report(table, [(convert_end(start), convert_start(end)) for start, end in zip(grouped[0], grouped[1])],
+                         max_date)
+
+def get_timestamps_since(conn, table, date_col, station_col=None, since=None, schema=SCHEMA):
+    """Точки не раньше водяного знака.
+
+    С колонкой станции since - словарь станция -> дата: каждая известная станция
+    читается со своей даты, новые станции - целиком. Без неё since - одна дата или None.
+    Даты станций передаются двумя массивами и соединяются с таблицей через unnest,
+    так что размер запроса не растёт с числом станций.
+    """
+    conditions = [f't."{date_col}" IS NOT NULL']
+    params = []
+    source = f'"{schema}"."{table}" t'
+    if station_col:
+        columns = f't."{station_col}", t."{date_col}"'
+        conditions.append(f't."{station_col}" IS NOT NULL')
+        if since:
+            # Типы массивов psycopg2 выводит из значений, прочитанных из этих же колонок
+            source += (f' LEFT JOIN unnest(%s, %s) AS w(station, since) '
+                       f'ON w.station = t."{station_col}"')
+            params.extend([list(since), list(since.values())])
+            conditions.append(f'(w.since IS NULL OR t."{date_col}" >= w.since)')
+    else:
+        columns = f'NULL, t."{date_col}"'
+        if since is not None:
+            conditions.append(f't."{date_col}" >= %s')
+            params.append(since)
+    with conn.cursor() as cur:
+        cur.execute(
+            f'SELECT {columns} FROM {source} WHERE {" AND ".join(conditions)} ORDER BY t."{date_col}"',
+            params)
+        return cur.fetchall()
+
+def encode_ts(value):
+    if isinstance(value, datetime.datetime):
+        return 'dt:' + value.isoformat()
+    return 'd:' + value.isoformat()
+
+def decode_ts(value):
+    kind, raw = value.split(':', 1)
+    if kind == 'dt':
+        return datetime.datetime.fromisoformat(raw)
+    return datetime.date.fromisoformat(raw)
+
+def load_state(path=STATE_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state, path=STATE_FILE):
+    # Своё имя временного файла у каждого потока: воркер может выполнять проверки одновременно
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def count_intervals(timestamps, after=None):
+    "Число повторов каждого положительного интервала между соседними точками, с after - кончающихся позже него"
+    counts = {}
+    for prev, ts in zip(timestamps, timestamps[1:]):
+        if after is not None and ts <= after:
+            continue
+        interval = (ts - prev).total_seconds()
+        if interval > 0:
+            counts[interval] = counts.get(interval, 0) + 1
+    return counts
+
+def median_of_counts(counts):
+    # Та же медиана, что find_min_interval по полному списку интервалов
+    total = sum(counts.values())
+    if not total:
+        return None
+    wanted = [total // 2 - 1, total // 2] if total % 2 == 0 else [total // 2]
+    values = []
+    seen = 0
+    for interval, count in sorted(counts.items()):
+        seen += count
+        while wanted and wanted[0] < seen:
+            values.append(interval)
+            wanted.pop(0)
+        if not wanted:
+            break
+    return sum(values) / len(values) if len(values) == 2 else values[0]
+
+def station_since(stored, overlap):
+    """С какой даты перечитывать станцию: её последняя дата минус перекрытие.
+
+    Если в окно попадает конец уже найденного пропуска, окно расширяется до его начала,
+    чтобы пропуск был найден заново целиком.
+    """
+    since = stored['last'] - datetime.timedelta(seconds=overlap)
+    for start, end, _ in stored['gaps']:
+        if end >= since:
+            since = min(since, start)
+    return since
 
-    all_gaps_sorted = sorted(all_gaps, key=lambda x: x[0])
-    grouped_all = group_gaps(all_gaps_sorted)
-    ranges_str = ", ".join(
-        f"({start.strftime('%d.%m.%Y')}-{end.strftime('%d.%m.%Y')})" for start, end, _ in grouped_all
-    )
-    return f"{table} - есть пропуски {ranges_str}. Последняя дата: {max_date_overall}\n"
+def analyze_time_series_incremental(conn, table, date_col, station_col, state, overlap=INCREMENTAL_OVERLAP):
+    # Состояние таблицы по каждой станции: последняя проверенная дата (водяной знак станции),
+    # счётчики интервалов между точками, медиана по ним и уже найденные пропуски. Счётчики
+    # пополняются интервалами новых точек, так что медиана та же, что при полной проверке.
+    # Если медиана сдвинулась, старые пропуски надо искать с новым порогом: такая станция
+    # перечитывается целиком, как и станция без счётчиков (старое состояние или их слишком много).
+    table_state = state.get(table)
+    if not table_state or table_state.get('date_col') != date_col or table_state.get('station_col') != station_col:
+        table_state = {'date_col': date_col, 'station_col': station_col, 'stations': []}
+
+    stations = {}
+    for item in table_state['stations']:
+        intervals = item.get('intervals')
+        stations[item['station']] = {
+            'last': decode_ts(item['last']),
+            'median': item['median'],
+            'intervals': {interval: count for interval, count in intervals} if intervals is not None else None,
+            'gaps': [(decode_ts(a), decode_ts(b), datetime.timedelta(seconds=total)) for a, b, total in item['gaps']],
+        }
+    since = {station_id: station_since(item, overlap) for station_id, item in stations.items()}
+
+    new_timestamps = {}
+    rows = get_timestamps_since(conn, table, date_col, station_col,
+                                since if station_col else since.get(None))
+    for station_id, ts in rows:
+        new_timestamps.setdefault(station_id, []).append(ts)
+
+    for station_id, fresh in new_timestamps.items():
+        stored = stations.get(station_id)
+        timestamps = sorted(set(fresh))
+
+        kept = []
+        if stored is None:
+            # Новая станция прочитана целиком
+            intervals = count_intervals(timestamps)
+            median = median_of_counts(intervals)
+        else:
+            intervals, median = None, None
+            if stored['intervals'] is not None:
+                intervals = dict(stored['intervals'])
+                for interval, count in count_intervals(timestamps, after=stored['last']).items():
+                    intervals[interval] = intervals.get(interval, 0) + count
+                median = median_of_counts(intervals)
+            if intervals is not None and median == stored['median']:
+                # Пропуски, закончившиеся до окна, заново не ищутся; остальные найдутся по точкам окна
+                kept = [g for g in stored['gaps'] if g[1] < since[station_id]]
+            else:
+                timestamps = sorted(set(get_timestamps(conn, table, date_col, where=station_col, where_val=station_id)))
+                intervals = count_intervals(timestamps)
+                median = median_of_counts(intervals)
+
+        new_gaps = group_gaps(find_significant_gaps(timestamps, median, factor=3)) if median else []
+        last = max(timestamps[-1], stored['last']) if stored else timestamps[-1]
+        stations[station_id] = {
+            'last': last,
+            'median': median,
+            'intervals': intervals if len(intervals) <= INCREMENTAL_MAX_INTERVALS else None,
+            'gaps': group_gaps(sorted(kept + new_gaps, key=lambda x: x[0])),
+        }
+
+    all_gaps = []
+    max_date_overall = None
+    max_date_all = None
+    for item in stations.values():
+        if max_date_all is None or item['last'] > max_date_all:
+            max_date_all = item['last']
+        if item['median'] is None:
+            continue
+        all_gaps.extend(item['gaps'])
+        if max_date_overall is None or item['last'] > max_date_overall:
+            max_date_overall = item['last']
+
+    table_state['stations'] = [
+        {
+            'station': station_id,
+            'last': encode_ts(item['last']),
+            'median': item['median'],
+            'intervals': sorted(item['intervals'].items()) if item['intervals'] is not None else None,
+            'gaps': [(encode_ts(a), encode_ts(b), gap.total_seconds()) for a, b, gap in item['gaps']],
+        }
+        for station_id, item in stations.items()
+    ]
+    table_state.pop('watermark', None)
+    state[table] = table_state
+
+    if not station_col and max_date_overall is None:
+        return insufficient_report(table, max_date_all)
+    return gaps_report(table, all_gaps, max_date_overall)
 
 def check_db_connection(conn):
     try:
@@ -206,45 +1323,299 @@ def check_db_connection(conn):
     except Exception as e:
         return f"[ERROR] Ошибка подключения к БД: {e}"
 
-def main():
+def classify_columns(columns):
+    start_col = next((c for c in EVENT_START_CANDIDATES if c in columns), None)
+    end_col = next((c for c in EVENT_END_CANDIDATES if c in columns), None)
+    if start_col and end_col:
+        return ('event', start_col, end_col)
+
+    date_col = next((c for c in DATE_CANDIDATES if c in columns), None)
+    if not date_col:
+        return None
+
+    station_col = next((c for c in STATION_CANDIDATES if c in columns and c != date_col), None)
+    return ('series', date_col, station_col)
+
+def analyze_table(conn, table, plan, args, state=None, profile=None):
+    if plan is None:
+        return None
+    kind, first_col, second_col = plan
+    with profile_table(profile, table):
+        if kind == 'event':
+            return EVENT_ENGINES.get(args.engine, analyze_event_table)(conn, table, first_col, second_col)
+        if args.incremental:
+            return analyze_time_series_incremental(conn, table, first_col, second_col, state, args.overlap)
+        return TIME_SERIES_ENGINES[args.engine](conn, table, first_col, second_col)
+
+def with_pooled_conn(pool, func, *func_args):
+    conn = pool.getconn()
+    try:
+        return func(conn, *func_args)
+    finally:
+        pool.putconn(conn)
+
+def analyze_time_series_by_station(pool, executor, table, date_col, station_col, profile=None):
+    # Станции одной большой таблицы разбираются параллельно, каждая на своём соединении.
+    with profile_table(profile, table) as record:
+        station_ids = with_pooled_conn(pool, get_distinct, table, station_col)
+        futures = [
+            executor.submit(in_profile, record, with_pooled_conn, pool, analyze_station,
+                            table, date_col, station_col, station_id)
+            for station_id in station_ids
+        ]
+
+        all_gaps = []
+        max_date_overall = None
+        for future in futures:
+            result = future.result()
+            if result is None:
+                continue
+            grouped_gaps, max_station_date = result
+            all_gaps.extend(grouped_gaps)
+            if max_station_date and (max_date_overall is None or max_station_date > max_date_overall):
+                max_date_overall = max_station_date
+        return gaps_report(table, all_gaps, max_date_overall)
+
+def run_parallel(plans, args, state=None, profile=None):
+    from concurrent.futures import ThreadPoolExecutor
+    from psycopg2.pool import ThreadedConnectionPool
+
+    # Отдельный пул потоков для станций, чтобы задачи таблиц, ожидающие свои станции,
+    # не занимали все потоки и не блокировали друг друга.
+    pool = ThreadedConnectionPool(1, args.workers * 2, DB_DSN, cursor_factory=connection_cursor_factory(profile))
+    try:
+        with ThreadPoolExecutor(args.workers) as table_executor, \
+                ThreadPoolExecutor(args.workers) as station_executor:
+            futures = []
+            for table, plan in plans:
+                if plan and plan[0] == 'series' and plan[2] and args.engine == 'python' and not args.incremental:
+                    future = table_executor.submit(
+                        analyze_time_series_by_station, pool, station_executor, table, plan[1], plan[2], profile)
+                else:
+                    future = table_executor.submit(
+                        with_pooled_conn, pool, analyze_table, table, plan, args, state, profile)
+                futures.append(future)
+            return [report for report in (future.result() for future in futures) if report is not None]
+    finally:
+        pool.closeall()
+
+def get_table_sizes(conn, schema=SCHEMA):
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname, c.reltuples
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind IN ('r', 'p')
+        """, (schema,))
+        return dict(cur.fetchall())
+
+def run_with_budget(conn, plans, args, state=None, profile=None):
+    # Сначала дешёвые таблицы (по оценке pg_class.reltuples), каждая строка печатается
+    # сразу. statement_timeout ставится один раз на таблицу по остатку бюджета, а между
+    # станциями срок проверяется отдельно.
+    deadline = time.monotonic() + args.budget
+    sizes = get_table_sizes(conn)
+    reports = []
+    try:
+        for table, plan in sorted(plans, key=lambda item: (max(sizes.get(item[0], 0), 0), item[0])):
+            if plan is None:
+                continue
+            if deadline - time.monotonic() <= 0:
+                report = TableReport(table, 'skipped', message="пропущена (бюджет времени исчерпан)", dated=False)
+            else:
+                try:
+                    set_statement_timeout(conn, deadline - time.monotonic())
+                    with time_budget(deadline):
+                        report = analyze_table(conn, table, plan, args, state, profile)
+                except (BudgetExceeded, psycopg2.extensions.QueryCanceledError):
+                    conn.rollback()
+                    report = TableReport(table, 'skipped', message="пропущена (не уложилась в бюджет времени)",
+                                         dated=False)
+            if args.format == 'text':
+                print(report, end='', flush=True)
+            reports.append(report)
+    finally:
+        if not conn.closed:
+            conn.rollback()
+            set_statement_timeout(conn, None)
+    return reports
+
+def connection_cursor_factory(profile):
+    return ProfilingCursor if profile is not None else None
+
+def finish_profile_record(record):
+    record.pop('_trace_memory', None)
+    record.setdefault('total_time', 0.0)
+    record.setdefault('query_time', 0.0)
+    record.setdefault('queries', 0)
+    record.setdefault('rows', 0)
+    record['compute_time'] = max(0.0, record['total_time'] - record['query_time'])
+    return record
+
+def table_profile(profile, table):
+    # Запросы станций учитываются в их собственных записях и суммируются в таблицу;
+    # total_time таблицы - реальное время, в том числе при параллельном разборе станций.
+    record = dict(profile[table], table=table)
+    record['stations'] = [finish_profile_record(dict(st)) for st in record['stations']]
+    for key in ('query_time', 'queries', 'rows'):
+        record[key] = record.get(key, 0) + sum(st[key] for st in record['stations'])
+    return finish_profile_record(record)
+
+def build_json_report(reports, profile, top):
+    tables = []
+    for report in reports:
+        if report.table not in profile:
+            continue
+        record = table_profile(profile, report.table)
+        record.update(report.as_dict())
+        tables.append(record)
+
+    slowest = sorted(tables, key=lambda r: r['total_time'], reverse=True)[:top]
+    return {
+        'tables': tables,
+        'slowest': [{'table': r['table'], 'total_time': r['total_time']} for r in slowest],
+    }
+
+def format_slowest(profile, top):
+    records = sorted((table_profile(profile, t) for t, r in profile.items() if 'total_time' in r),
+                     key=lambda r: r['total_time'], reverse=True)[:top]
+    lines = ["Самые медленные таблицы:"]
+    for r in records:
+        lines.append(f"  {r['table']}: {r['total_time']:.2f} с (запросы {r['query_time']:.2f} с, "
+                     f"вычисления {r['compute_time']:.2f} с, строк {r['rows']})")
+    return "\n".join(lines) + "\n"
+
+TIME_SERIES_ENGINES = {
+    'python': analyze_time_series,
+    'sql': analyze_time_series_sql,
+    'stream': analyze_time_series_stream,
+    'numpy': analyze_time_series_numpy,
+    'approx': analyze_time_series_approx,
+}
+
+EVENT_ENGINES = {
+    'stream': analyze_event_table_stream,
+    'numpy': analyze_event_table_numpy,
+}
+
+def main(argv=None, conn=None):
+    # conn передаёт долгоживущий воркер (worker.py): такое соединение не закрывается.
     import argparse
     parser = argparse.ArgumentParser(description="Проверка целостности данных")
-    parser.add_argument('command', choices=['dbconn', 'data'], help="Команда проверки")
-    args = parser.parse_args()
+    parser.add_argument('command', choices=['dbconn', 'data', 'fresh'], help="Команда проверки")
+    parser.add_argument('--engine', choices=sorted(TIME_SERIES_ENGINES), default='python',
+                        help="Способ поиска пропусков: python, sql (на стороне PostgreSQL), "
+                             "stream (потоковое чтение серверным курсором), numpy "
+                             "или approx (приблизительно, по выборке TABLESAMPLE)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Проверять только новые данные после сохранённого водяного знака")
+    parser.add_argument('--state-file', default=STATE_FILE, help="Файл состояния для --incremental")
+    parser.add_argument('--overlap', type=int, default=INCREMENTAL_OVERLAP,
+                        help="Перекрытие окна перепроверки в секундах для --incremental")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Число параллельных потоков и соединений с БД")
+    parser.add_argument('--budget', type=float, default=None,
+                        help="Бюджет времени на проверку в секундах: результаты печатаются сразу, "
+                             "не уложившиеся таблицы пропускаются")
+    parser.add_argument('--format', choices=['text', 'json'], default='text',
+                        help="Формат вывода для data; json включает метрики времени по таблицам и станциям")
+    parser.add_argument('--profile', action='store_true',
+                        help="Добавить к текстовому отчёту сводку самых медленных таблиц")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Добавить к метрикам --format json/--profile пик памяти по tracemalloc; "
+                             "трассировка замедляет разбор в несколько раз, и время в метриках завышено")
+    parser.add_argument('--top', type=int, default=5, help="Сколько самых медленных таблиц показывать")
+    parser.add_argument('--max-lag', type=int, default=FRESHNESS_MAX_LAG,
+                        help="Для fresh: через сколько секунд без новых данных ряд считается устаревшим")
+    parser.add_argument('--schema-cache', default=SCHEMA_CACHE_FILE, help="Файл кэша схемы БД")
+    parser.add_argument('--refresh-schema', action='store_true',
+                        help="Перечитать схему БД, не доверяя кэшу (нужно после RENAME COLUMN "
+                             "и DROP COLUMN: их кэш сам не замечает)")
+    args = parser.parse_args(argv)
+    if args.budget and args.workers > 1:
+        parser.error("--budget работает только с --workers 1")
+    if args.format == 'json' and args.command != 'data':
+        parser.error("--format json поддерживается только для data")
+    if args.trace_memory and not (args.command == 'data' and (args.format == 'json' or args.profile)):
+        parser.error("--trace-memory работает только с data и --format json или --profile")
+    if args.trace_memory and conn is not None:
+        # Соединение передаёт только воркер, а в нём трассировка задела бы соседние задачи
+        parser.error("--trace-memory недоступен в воркере")
+    if args.trace_memory and args.budget:
+        parser.error("--trace-memory нельзя совмещать с --budget: трассировка съедает бюджет времени")
 
     output = ""
-    conn = None
+    reports = []
+    own_conn = conn is None
 
-    try:
-        conn = psycopg2.connect(DB_DSN)
-    except Exception as e:
-        print(f"[ERROR] Ошибка подключения к БД: {e}")
-        sys.exit(1)
+    profile = {} if args.command == 'data' and (args.format == 'json' or args.profile) else None
+    # Трассировка памяти общая для процесса и дорогая, поэтому только по явному --trace-memory
+    # (воркер этот флаг не принимает).
+    trace_memory = args.trace_memory and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+
+    if own_conn:
+        try:
+            conn = psycopg2.connect(DB_DSN, cursor_factory=connection_cursor_factory(profile))
+        except Exception as e:
+            print(f"[ERROR] Ошибка подключения к БД: {e}")
+            sys.exit(1)
+    else:
+        conn.cursor_factory = connection_cursor_factory(profile)
 
     if args.command == 'dbconn':
         output = check_db_connection(conn)
+    elif args.command == 'fresh':
+        schema_info = get_schema_info(conn, cache_file=args.schema_cache, refresh=args.refresh_schema)
+        db_now = get_db_now(conn)
+        for table, info in schema_info.items():
+            if info['plan']:
+                output += check_freshness(conn, table, info['plan'], info['indexes'], db_now, args.max_lag)
     elif args.command == 'data':
-        tables = get_tables(conn)
-        for table in tables:
-            columns = get_columns(conn, table)
-
-            start_col = next((c for c in EVENT_START_CANDIDATES if c in columns), None)
-            end_col = next((c for c in EVENT_END_CANDIDATES if c in columns), None)
-            if start_col and end_col:
-                output += analyze_event_table(conn, table, start_col, end_col)
-                continue
-
-            date_col = next((c for c in DATE_CANDIDATES if c in columns), None)
-            if not date_col:
-                continue
+        state = load_state(args.state_file) if args.incremental else None
+        schema_info = get_schema_info(conn, cache_file=args.schema_cache, refresh=args.refresh_schema)
+        plans = [(table, tuple(info['plan']) if info['plan'] else None) for table, info in schema_info.items()]
+        if profile is not None:
+            for table, plan in plans:
+                profile[table] = {
+                    'kind': plan[0] if plan else None,
+                    'engine': 'incremental' if args.incremental else args.engine,
+                    'stations': [],
+                    '_trace_memory': args.trace_memory,
+                }
+        if args.budget:
+            reports = run_with_budget(conn, plans, args, state, profile)
+        elif args.workers > 1:
+            reports = run_parallel(plans, args, state, profile)
+        else:
+            reports = [analyze_table(conn, table, plan, args, state, profile) for table, plan in plans]
+            reports = [report for report in reports if report is not None]
+        output = "".join(str(report) for report in reports)
 
-            station_col = next((c for c in STATION_CANDIDATES if c in columns and c != date_col), None)
-            output += analyze_time_series(conn, table, date_col, station_col)
+        if args.incremental:
+            save_state(state, args.state_file)
+    if trace_memory:
+        tracemalloc.stop()
 
-    if conn:
+    if own_conn:
         conn.close()
+    else:
+        conn.rollback()
+
+    if args.command == 'data' and args.format == 'json':
+        print(json.dumps(build_json_report(reports, profile, args.top), ensure_ascii=False, default=str))
+        return
 
-    print(output)
+    uncertain = args.command == 'data' and any(not c for r in reports for _, _, c in r.gaps)
+    note = APPROX_NOTE if uncertain else ""
+    if args.command == 'data' and args.profile:
+        note += format_slowest(profile, args.top)
+    if args.command == 'data' and args.budget:
+        # Строки таблиц уже напечатаны по мере готовности.
+        print(note)
+    else:
+        print(output + note)
 
 if __name__ == '__main__':
     main()
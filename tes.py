@@ -8,23 +8,612 @@ Dump using:
 mysqldump --compatible=postgresql --default-character-set=utf8 -r databasename.mysql -u root databasename
 """
 
+import argparse
+import fnmatch
+import gzip
+import io
+import json
+import multiprocessing
 import re
 import sys
 import os
+import queue
+import stat
+import subprocess
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+try:
+    import psycopg2
+except ImportError:  # нужен только для прямой загрузки (--dsn)
+    psycopg2 = None
 
-def parse(input_filename, output_filename):
-    "Feed it a file, and it'll output a fixed one"
+try:
+    import zstandard
+except ImportError:  # нужен только для дампов .zst
+    zstandard = None
 
-    # Подсчёт строк без использования wc (кроссплатформенно)
-    if input_filename == "-":
-        num_lines = -1
+# Имя таблицы: в кавычках - любые символы до закрывающей кавычки (foo-bar), без кавычек - \w+
+TABLE_NAME = r'[`"]?((?<=`)[^`]+|(?<=")[^"]+|\w+)[`"]?'
+INSERT_RE = re.compile(r'INSERT INTO ' + TABLE_NAME + r'\s*(?:\(([^)]*)\)\s*)?VALUES\s*(.*)$')
+INSERT_TABLE_RE = re.compile(r'INSERT INTO ' + TABLE_NAME)
+INSERT_TABLE_BYTES_RE = re.compile(b'INSERT INTO ' + TABLE_NAME.encode())
+CREATE_TABLE_RE = re.compile(r'CREATE TABLE ' + TABLE_NAME)
+# Таблица, к которой относится сгенерированная post-data команда
+POST_DATA_TABLE_RE = re.compile(
+    r'(?:ALTER TABLE "([^"]+)"|CREATE INDEX ON (?:"([^"]+)"|(\S+))|CREATE SEQUENCE (.+)_id_seq|SELECT setval\(\'(.+?)_id_seq\')')
+REFERENCES_RE = re.compile(r'REFERENCES [`"]?(\w+)')
+VALUE_RE = re.compile(
+    r"\s*(\()?\s*(?:'([^'\\]*(?:(?:\\.|'')[^'\\]*)*)'|([^,()\s']+))\s*(?:,|(\))\s*(?:,|$))\s*", re.DOTALL)
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+PARALLEL_BATCH_SIZE = 4 * 1024 * 1024
+INPUT_BUFFER_SIZE = 4 * 1024 * 1024
+OUTPUT_BUFFER_SIZE = 4 * 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+PROGRESS_INTERVAL = 1.0
+CHECKPOINT_INTERVAL = 60.0
+ZERO_DATETIME = "0000-00-00 00:00:00"
+STRING_ESCAPE_RE = re.compile(r"\\(.)|''|[\t\n\r]", re.DOTALL)
+
+# Экранирование MySQL -> текстовый формат COPY
+COPY_ESCAPES = {
+    "0": "", "'": "'", '"': '"', "b": "\\b", "n": "\\n", "r": "\\r", "t": "\\t",
+    "Z": "\x1a", "\\": "\\\\",
+    "\t": "\\t", "\n": "\\n", "\r": "\\r",
+}
+
+
+def copy_string(value):
+    if "\\" not in value and "'" not in value and "\t" not in value and "\n" not in value and "\r" not in value:
+        return value
+
+    def replacer(match):
+        if match.group(1) is not None:
+            return COPY_ESCAPES.get(match.group(1), match.group(1))
+        if match.group(0) == "''":
+            return "'"
+        return COPY_ESCAPES[match.group(0)]
+    return STRING_ESCAPE_RE.sub(replacer, value)
+
+
+def copy_rows(values):
+    "Разбирает VALUES (...),(...) из extended insert и отдаёт строки в формате COPY"
+    fields = []
+    end = 0
+    for match in iter(VALUE_RE.scanner(values).match, None):
+        opening, quoted, bare, closing = match.groups()
+        if (opening is None) is not bool(fields):
+            raise ValueError(f"Неожиданная '(' в позиции {match.start()}" if fields
+                             else f"Ожидалась '(' в позиции {match.start()}")
+        if quoted is not None:
+            fields.append(copy_string(quoted) if quoted != ZERO_DATETIME else "\\N")
+        elif bare == "NULL":
+            fields.append("\\N")
+        elif bare[:2] in ("0x", "0X"):
+            fields.append("\\\\x" + bare[2:])
+        else:
+            fields.append(bare)
+        if closing:
+            yield "\t".join(fields)
+            fields = []
+        end = match.end()
+    if fields or end != len(values):
+        raise ValueError(f"Не удалось разобрать значение в позиции {end}")
+
+
+class TableFilter:
+    "Фильтр таблиц по шаблонам fnmatch: include (если задан) и exclude, результат кешируется по имени"
+
+    def __init__(self, include=None, exclude=None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.cache = {}
+
+    def __bool__(self):
+        return bool(self.include or self.exclude)
+
+    def wanted(self, table):
+        result = self.cache.get(table)
+        if result is None:
+            result = ((not self.include or any(fnmatch.fnmatchcase(table, p) for p in self.include))
+                      and not any(fnmatch.fnmatchcase(table, p) for p in self.exclude))
+            self.cache[table] = result
+        return result
+
+
+def fix_escapes(line):
+    "Обрезает строку и переводит \\' в '' не трогая \\\\"
+    return line.strip().replace(r"\\", "WUBWUBREALSLASHWUB").replace(r"\'", "''").replace("WUBWUBREALSLASHWUB", r"\\")
+
+
+def convert_insert(line, copy):
+    """Преобразует одну строку INSERT.
+
+    Возвращает (как COPY, таблица, список колонок, данные, предупреждение): для COPY
+    данные - строки в текстовом формате COPY, иначе SQL-строка INSERT. Таблица None,
+    только если её имя не удалось найти в строке.
+    """
+    line = fix_escapes(line)
+    warning = None
+    if copy:
+        # Extended insert -> строки для блока COPY ... FROM stdin
+        match = INSERT_RE.match(line)
+        try:
+            if not match:
+                raise ValueError("не найдено VALUES")
+            table_name, column_list, values = match.groups()
+            data = "".join(row + "\n" for row in copy_rows(values.rstrip(";")))
+            return True, table_name, column_list, data, None
+        except ValueError as e:
+            # Строку, которую не удалось разобрать, оставляем обычным INSERT
+            warning = f"\n ! Не удалось преобразовать INSERT в COPY ({e}): {line[:100]}"
+    match = INSERT_TABLE_RE.match(line)
+    # Заменяем '0000-00-00 00:00:00' на NULL
+    return (False, match.group(1) if match else None, None,
+            line.replace("'0000-00-00 00:00:00'", "NULL") + "\n", warning)
+
+
+def convert_inserts(lines, copy):
+    "Пакетная обёртка над convert_insert для пула процессов"
+    return [convert_insert(line, copy) for line in lines]
+
+
+class CountingReader(io.RawIOBase):
+    "Считает байты, прочитанные из исходного потока (до распаковки и декодирования)"
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        if n:
+            self.count += n
+        return n
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.count = self.raw.seek(offset, whence)
+        return self.count
+
+    def close(self):
+        if self.raw is not sys.stdin.buffer:
+            self.raw.close()
+        super().close()
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+class Progress:
+    """Прогресс по прочитанным байтам относительно размера входного файла.
+
+    Вывод не чаще раза в interval секунд; для stdin и пайпов размер неизвестен,
+    тогда показываются только прочитанные байты.
+    """
+
+    def __init__(self, stream, reader, total, interval=PROGRESS_INTERVAL):
+        self.stream = stream
+        self.reader = reader
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.next_update = self.started
+
+    def update(self, tables, inserts, force=False):
+        now = time.monotonic()
+        if now < self.next_update and not force:
+            return
+        self.next_update = now + self.interval
+        done = self.reader.count
+        if self.total:
+            fraction = min(done / self.total, 1.0)
+            secs_left = (now - self.started) / fraction - (now - self.started) if fraction else 0
+            position = f"{format_size(done)} of {format_size(self.total)}: {fraction * 100:.2f}%"
+        else:
+            secs_left = 0
+            position = f"{format_size(done)} of ?"
+        self.stream.write("\rRead %s [%s tables] [%s inserts] [ETA: %i min %i sec]   " % (
+            position,
+            tables,
+            inserts,
+            int(secs_left // 60),
+            int(secs_left % 60),
+        ))
+        self.stream.flush()
+
+
+class ThreadedReader(io.RawIOBase):
+    "Читает источник блоками в отдельном потоке, чтобы распаковка шла параллельно с конвертацией"
+
+    def __init__(self, source, block_size=INPUT_BUFFER_SIZE, depth=4):
+        self.source = source
+        self.block_size = block_size
+        self.blocks = queue.Queue(depth)
+        self.current = memoryview(b"")
+        self.eof = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            while True:
+                block = self.source.read(self.block_size)
+                self.blocks.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self.blocks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.current:
+            if self.eof:
+                return 0
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.current = memoryview(block)
+        n = min(len(buffer), len(self.current))
+        buffer[:n] = self.current[:n]
+        self.current = self.current[n:]
+        return n
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("Для дампов zstd нужен пакет zstandard (pip install zstandard)")
+
+
+def open_input(input_filename, decompress_thread=False, offset=0):
+    """Открывает вход крупными блоками и возвращает (поток строк в байтах, счётчик байт, размер или None).
+
+    gzip и zstd распознаются по сигнатуре, поэтому сжатый дамп можно подать и через stdin.
+    Счётчик байт стоит до распаковки, прогресс считается по сжатому файлу. offset - позиция
+    в распакованных данных, с которой продолжить (для --resume).
+    """
+    raw = sys.stdin.buffer if input_filename == "-" else open(input_filename, "rb", buffering=0)
+    try:
+        # Размер известен и для stdin, перенаправленного из обычного файла
+        st = os.fstat(raw.fileno())
+        total = st.st_size if stat.S_ISREG(st.st_mode) and st.st_size else None
+    except (OSError, io.UnsupportedOperation):
+        total = None
+    reader = CountingReader(raw)
+    stream = io.BufferedReader(reader, buffer_size=INPUT_BUFFER_SIZE)
+    magic = stream.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif magic == ZSTD_MAGIC:
+        require_zstandard()
+        stream = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            stream, read_size=INPUT_BUFFER_SIZE, read_across_frames=True), buffer_size=INPUT_BUFFER_SIZE)
+    elif offset and reader.seekable():
+        stream.seek(offset)
+        offset = 0
+    # Сжатый поток и пайп перематываются чтением
+    while offset:
+        skipped = len(stream.read(min(offset, INPUT_BUFFER_SIZE)))
+        if not skipped:
+            raise ValueError("Вход короче позиции из контрольной точки")
+        offset -= skipped
+    if decompress_thread:
+        stream = io.BufferedReader(ThreadedReader(stream), buffer_size=INPUT_BUFFER_SIZE)
+    return stream, reader, total
+
+
+def open_output(output_filename, offset=None):
+    """Открывает выходной файл, сжимая его в gzip или zstd по расширению .gz / .zst.
+
+    С offset файл обрезается до этой позиции и дописывается (только без сжатия).
+    """
+    if offset is None:
+        raw = open(output_filename, "wb", buffering=OUTPUT_BUFFER_SIZE)
     else:
-        def count_lines(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                return sum(1 for _ in f)
-        num_lines = count_lines(input_filename)
+        if os.path.getsize(output_filename) < offset:
+            raise ValueError("Выходной файл короче позиции из контрольной точки")
+        raw = open(output_filename, "r+b", buffering=OUTPUT_BUFFER_SIZE)
+        raw.seek(offset)
+        raw.truncate()
+    if output_filename.endswith(".gz"):
+        stream = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+    elif output_filename.endswith((".zst", ".zstd")):
+        require_zstandard()
+        stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+    else:
+        return io.TextIOWrapper(raw, encoding="utf-8"), raw
+    # Буфер перед компрессором: мелкие строки дампа сжимаются крупными блоками
+    return io.TextIOWrapper(io.BufferedWriter(stream, buffer_size=OUTPUT_BUFFER_SIZE), encoding="utf-8"), raw
+
+
+def copy_header(table, columns):
+    column_sql = ", ".join(f'"{c}"' for c in columns)
+    return f'COPY "{table}" ({column_sql}) FROM stdin' if columns else f'COPY "{table}" FROM stdin'
+
+
+class Writer:
+    "Общая часть вывода: INSERT пишется как обычная команда, post-data - одним скриптом"
+
+    def insert(self, table, sql):
+        self.statement(sql)
+
+    def post_data(self, cast_lines, foreign_key_lines, sequence_lines, fulltext_key_lines):
+        self.comment("\n-- Post-data save --\n")
+        self.statement("COMMIT;\n")
+        self.statement("START TRANSACTION;\n")
+
+        self.comment("\n-- Typecasts --\n")
+        for line in cast_lines:
+            self.statement(f"{line};\n")
+
+        self.comment("\n-- Foreign keys --\n")
+        for line in foreign_key_lines:
+            self.statement(f"{line};\n")
+
+        self.comment("\n-- Sequences --\n")
+        for line in sequence_lines:
+            self.statement(f"{line};\n")
+
+        self.comment("\n-- Full Text keys --\n")
+        for line in fulltext_key_lines:
+            self.statement(f"{line};\n")
+
+        self.statement("\nCOMMIT;\n")
+
+
+class SqlFileWriter(Writer):
+    "Пишет результат конвертации в SQL-файл для последующей загрузки через psql"
+
+    def __init__(self, fh, raw=None):
+        self.fh = fh
+        # Файл под сжимающим потоком, gzip его сам не закрывает
+        self.raw = raw
+
+    def statement(self, sql):
+        self.fh.write(sql)
+
+    def comment(self, text):
+        self.fh.write(text)
+
+    def copy_start(self, table, columns):
+        self.fh.write(copy_header(table, columns) + ";\n")
+
+    def copy_data(self, data):
+        self.fh.write(data)
+
+    def copy_end(self):
+        self.fh.write("\\.\n\n")
+
+    def position(self):
+        "Сбрасывает всё на диск и возвращает длину файла (для контрольной точки)"
+        self.fh.flush()
+        os.fsync(self.raw.fileno())
+        return self.raw.tell()
+
+    def close(self):
+        if self.fh is not sys.stdout:
+            self.fh.close()
+        if self.raw is not None and not self.raw.closed:
+            self.raw.close()
+
+
+class PostgresWriter(Writer):
+    """Выполняет результат конвертации сразу в PostgreSQL.
+
+    DDL выполняется по мере разбора, строки данных копятся в буфере не больше
+    buffer_size и уходят в базу через copy_expert, на диск ничего не пишется.
+    """
+
+    def __init__(self, conn, buffer_size=COPY_BUFFER_SIZE):
+        self.conn = conn
+        # Транзакциями управляют START TRANSACTION / COMMIT из самого дампа
+        self.conn.autocommit = True
+        self.cursor = conn.cursor()
+        self.buffer_size = buffer_size
+        self.copy_sql = None
+        self.rows = []
+        self.size = 0
+
+    def statement(self, sql):
+        self.cursor.execute(sql)
+
+    def comment(self, text):
+        pass
+
+    def copy_start(self, table, columns):
+        self.copy_sql = copy_header(table, columns)
+
+    def copy_data(self, data):
+        self.rows.append(data)
+        self.size += len(data)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.cursor.copy_expert(self.copy_sql, io.StringIO("".join(self.rows)))
+            self.rows = []
+            self.size = 0
+
+    def copy_end(self):
+        self.flush()
+        self.copy_sql = None
+
+    def close(self):
+        self.conn.close()
+
+
+class SplitWriter(Writer):
+    """Пишет каталог для параллельного восстановления (как pg_restore -j).
+
+    pre-data.sql - типы и таблицы, data/<таблица>.sql - данные, post-data/tables - приведения
+    типов и последовательности по таблицам, post-data/indexes - по файлу на индекс,
+    post-data/foreign-keys - внешние ключи, сгруппированные по связанным таблицам, чтобы
+    параллельные ALTER TABLE не блокировали друг друга. В manifest.json шаги идут по
+    порядку, файлы внутри шага можно выполнять одновременно.
+    """
+
+    header = "SET standard_conforming_strings=off;\nSET escape_string_warning=off;\nSTART TRANSACTION;\n\n"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "data"), exist_ok=True)
+        self.pre_data = open(os.path.join(directory, "pre-data.sql"), "w", encoding="utf-8")
+        self.data = None
+        self.data_table = None
+        self.data_files = []
+        self.steps = []
+
+    def statement(self, sql):
+        self.pre_data.write(sql)
+
+    def comment(self, text):
+        self.pre_data.write(text)
+
+    def data_file(self, table):
+        if table != self.data_table:
+            self.close_data()
+            path = f"data/{table}.sql"
+            # Таблица может встретиться в дампе повторно, тогда дописываем её файл
+            self.data = open(os.path.join(self.directory, path), "a" if path in self.data_files else "w",
+                             encoding="utf-8")
+            if path not in self.data_files:
+                self.data_files.append(path)
+            self.data.write(self.header)
+            self.data_table = table
+        return self.data
+
+    def close_data(self):
+        if self.data is not None:
+            self.data.write("COMMIT;\n")
+            self.data.close()
+            self.data = None
+            self.data_table = None
+
+    def insert(self, table, sql):
+        if table is None:
+            raise ValueError(f"Не удалось определить таблицу INSERT для файла данных: {sql[:100]}")
+        self.data_file(table).write(sql)
+
+    def copy_start(self, table, columns):
+        self.data_file(table).write(copy_header(table, columns) + ";\n")
+
+    def copy_data(self, data):
+        self.data.write(data)
+
+    def copy_end(self):
+        self.data.write("\\.\n\n")
+
+    def write_group(self, path, lines):
+        os.makedirs(os.path.dirname(os.path.join(self.directory, path)), exist_ok=True)
+        with open(os.path.join(self.directory, path), "w", encoding="utf-8") as f:
+            f.write(self.header)
+            for line in lines:
+                f.write(f"{line};\n")
+            f.write("COMMIT;\n")
+        return path
+
+    def post_data(self, cast_lines, foreign_key_lines, sequence_lines, fulltext_key_lines):
+        self.pre_data.write("COMMIT;\n")
+        self.pre_data.close()
+        self.close_data()
+
+        def table_of(line):
+            return next(name for name in POST_DATA_TABLE_RE.match(line).groups() if name)
+
+        # Приведения типов и последовательности переписывают одну таблицу, их можно гнать параллельно
+        per_table = {}
+        for line in cast_lines + sequence_lines:
+            per_table.setdefault(table_of(line), []).append(line)
+
+        index_lines = [line for line in foreign_key_lines if line.startswith("CREATE INDEX")]
+        index_lines += fulltext_key_lines
+
+        # Внешние ключи блокируют обе таблицы: связанные таблицы объединяем в одну группу
+        parent = {}
+
+        def find(table):
+            while parent.setdefault(table, table) != table:
+                table = parent[table]
+            return table
+
+        constraint_lines = [line for line in foreign_key_lines if not line.startswith("CREATE INDEX")]
+        for line in constraint_lines:
+            match = REFERENCES_RE.search(line)
+            if match:
+                parent[find(match.group(1))] = find(table_of(line))
+        fk_groups = {}
+        for line in constraint_lines:
+            fk_groups.setdefault(find(table_of(line)), []).append(line)
+
+        self.steps = [
+            {"name": "pre-data", "files": ["pre-data.sql"]},
+            {"name": "data", "files": self.data_files},
+            {"name": "tables", "files": [self.write_group(f"post-data/tables/{table}.sql", lines)
+                                         for table, lines in per_table.items()]},
+            {"name": "indexes", "files": [self.write_group(f"post-data/indexes/{i:04d}_{table_of(line)}.sql", [line])
+                                          for i, line in enumerate(index_lines)]},
+            {"name": "foreign-keys", "files": [self.write_group(f"post-data/foreign-keys/{table}.sql", lines)
+                                               for table, lines in fk_groups.items()]},
+        ]
+
+    def close(self):
+        self.close_data()
+        with open(os.path.join(self.directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"steps": self.steps}, f, ensure_ascii=False, indent=2)
+
+
+def restore_split(directory, dsn, jobs=1, psql="psql"):
+    "Восстанавливает каталог SplitWriter: шаги по порядку, файлы шага в jobs параллельных psql"
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        steps = json.load(f)["steps"]
+
+    def run(path):
+        started = time.monotonic()
+        subprocess.run([psql, "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", dsn, "-f", os.path.join(directory, path)],
+                       check=True, stdout=subprocess.DEVNULL)
+        return path, time.monotonic() - started
+
+    with ThreadPoolExecutor(max(jobs, 1)) as executor:
+        for step in steps:
+            started = time.monotonic()
+            for path, elapsed in executor.map(run, step["files"]):
+                print(f"  {path}: {elapsed:.1f} с")
+            print(f"{step['name']}: {len(step['files'])} файлов за {time.monotonic() - started:.1f} с")
+
+
+def parse(input_filename, output_filename, copy=False, dsn=None, workers=1, decompress_thread=False,
+          split=False, checkpoint=False, resume=False, checkpoint_interval=CHECKPOINT_INTERVAL,
+          include=None, exclude=None):
+    """Feed it a file, and it'll output a fixed one
+
+    С workers > 1 строки INSERT пачками уходят в пул процессов, а основной процесс
+    разбирает CREATE TABLE и пишет результаты пачек в исходном порядке.
+
+    С checkpoint состояние разбора раз в checkpoint_interval секунд сохраняется в
+    <output>.checkpoint, resume продолжает с последней контрольной точки.
+
+    include / exclude - шаблоны имён таблиц: данные остальных таблиц отбрасываются по
+    префиксу сырой строки, их DDL и post-data не выводятся, внешние ключи на них тоже.
+    """
 
     tables = {}
     current_table = None
@@ -35,197 +624,356 @@ def parse(input_filename, output_filename):
     sequence_lines = []
     cast_lines = []
     num_inserts = 0
-    started = time.time()
+    copy_table = None
+    batch = []
+    batch_size = 0
+    pending = deque()
+    input_offset = 0
+    output_offset = None
+    checkpoint_file = f"{output_filename}.checkpoint"
+
+    if resume:
+        with open(checkpoint_file, encoding="utf-8") as f:
+            state = json.load(f)
+        tables = state["tables"]
+        current_table = state["current_table"]
+        creation_lines = state["creation_lines"]
+        enum_types = state["enum_types"]
+        foreign_key_lines = state["foreign_key_lines"]
+        fulltext_key_lines = state["fulltext_key_lines"]
+        sequence_lines = state["sequence_lines"]
+        cast_lines = state["cast_lines"]
+        num_inserts = state["num_inserts"]
+        copy_table = (state["copy_table"][0], tuple(state["copy_table"][1])) if state["copy_table"] else None
+        copy = state["copy"]
+        include, exclude = state["include"], state["exclude"]
+        input_offset = state["input_offset"]
+        output_offset = state["output_offset"]
+        checkpoint = True
+
+    table_filter = TableFilter(include, exclude)
 
     # Открываем файлы
-    if output_filename == "-":
-        output = sys.stdout
+    if dsn:
+        # Прямая загрузка: данные всегда идут через COPY
+        output = PostgresWriter(psycopg2.connect(dsn))
+        copy = True
+        logging = sys.stdout
+    elif split:
+        # Каталог для параллельного восстановления, данные тоже через COPY
+        output = SplitWriter(output_filename)
+        copy = True
+        logging = sys.stdout
+    elif output_filename == "-":
+        output = SqlFileWriter(sys.stdout)
         logging = open(os.devnull, "w")
     else:
-        output = open(output_filename, "w", encoding='utf-8')
+        output = SqlFileWriter(*open_output(output_filename, output_offset))
         logging = sys.stdout
 
-    if input_filename == "-":
-        input_fh = sys.stdin
-    else:
-        input_fh = open(input_filename, encoding='utf-8')
-
-    output.write("-- Converted by db_converter\n")
-    output.write("START TRANSACTION;\n")
-    output.write("SET standard_conforming_strings=off;\n")
-    output.write("SET escape_string_warning=off;\n")
-    output.write("SET CONSTRAINTS ALL DEFERRED;\n\n")
-
-    for i, line in enumerate(input_fh):
-        time_taken = time.time() - started
-        if num_lines > 0:
-            percentage_done = (i+1) / float(num_lines)
-            secs_left = (time_taken / percentage_done) - time_taken
-        else:
-            percentage_done = 0
-            secs_left = 0
-        logging.write("\rLine %i (of %s: %.2f%%) [%s tables] [%s inserts] [ETA: %i min %i sec]" % (
-            i + 1,
-            num_lines if num_lines > 0 else "?",
-            percentage_done*100,
-            len(tables),
-            num_inserts,
-            int(secs_left // 60),
-            int(secs_left % 60),
-        ))
-        logging.flush()
-
-        # В Python 3 line уже str, decode не нужен
-        line = line.strip().replace(r"\\", "WUBWUBREALSLASHWUB").replace(r"\'", "''").replace("WUBWUBREALSLASHWUB", r"\\")
-
-        # Игнорируем комментарии и служебные строки
-        if line.startswith("--") or line.startswith("/*") or line.startswith("LOCK TABLES") or line.startswith("DROP TABLE") or line.startswith("UNLOCK TABLES") or not line:
-            continue
-
-        # Обработка состояния
-        if current_table is None:
-            if line.startswith("CREATE TABLE"):
-                # Получаем имя таблицы из кавычек
-                # В MySQL дампе имя может быть в обратных кавычках ` или двойных "
-                # Попробуем универсально
-                match = re.search(r'CREATE TABLE [`"]?(\w+)[`"]?', line)
-                if match:
-                    current_table = match.group(1)
-                    tables[current_table] = {"columns": []}
-                    creation_lines = []
+    input_fh, reader, total_size = open_input(input_filename, decompress_thread, input_offset)
+    progress = Progress(logging, reader, total_size)
+
+    if not resume:
+        output.comment("-- Converted by db_converter\n")
+        output.statement("START TRANSACTION;\n")
+        output.statement("SET standard_conforming_strings=off;\n")
+        output.statement("SET escape_string_warning=off;\n")
+        output.statement("SET CONSTRAINTS ALL DEFERRED;\n\n")
+
+    def write_converted(converted):
+        nonlocal copy_table, num_inserts
+        for as_copy, table_name, column_list, data, warning in converted:
+            if not as_copy:
+                # Открытый блок COPY закрываем до обычного INSERT
+                if copy_table is not None:
+                    output.copy_end()
+                    copy_table = None
+                if warning:
+                    # Предупреждения - в stderr: при выводе в "-" stdout занят самим SQL
+                    print(warning, file=sys.stderr)
+                output.insert(table_name, data)
+            else:
+                # Подряд идущие INSERT одной таблицы попадают в один блок COPY
+                if column_list:
+                    columns = [c.strip().strip('`"') for c in column_list.split(",")]
                 else:
-                    print(f"\n ! Не удалось определить имя таблицы в строке: {line}")
-            elif line.startswith("INSERT INTO"):
-                # Заменяем '0000-00-00 00:00:00' на NULL
-                fixed_line = line.replace("'0000-00-00 00:00:00'", "NULL")
-                output.write(fixed_line + "\n")
-                num_inserts += 1
+                    columns = [c[0] for c in tables.get(table_name, {"columns": []})["columns"]]
+                key = (table_name, tuple(columns))
+                if copy_table != key:
+                    if copy_table is not None:
+                        output.copy_end()
+                    output.copy_start(table_name, columns)
+                    copy_table = key
+                output.copy_data(data)
+            num_inserts += 1
+
+    def flush_batch(drain=False):
+        nonlocal batch, batch_size
+        if batch:
+            if pool:
+                pending.append(pool.apply_async(convert_inserts, (batch, copy)))
             else:
-                # Можно убрать или оставить для отладки
-                # print(f"\n ! Unknown line in main body: {line}")
-                pass
+                write_converted(convert_inserts(batch, copy))
+            batch = []
+            batch_size = 0
+        # Ограничиваем число пачек в работе, чтобы не держать в памяти весь дамп
+        while pending and (drain or len(pending) > workers * 2):
+            write_converted(pending.popleft().get())
 
-        else:
-            # Внутри CREATE TABLE
-            if line.startswith('"') or line.startswith('`'):
-                # Разбор колонки
-                # Убираем начальные и конечные кавычки, разделяем по пробелу
-                parts = re.split(r'"|`', line.strip(","))
-                if len(parts) >= 3:
-                    name = parts[1]
-                    definition = parts[2].strip()
-                else:
-                    print(f"\n ! Не удалось разобрать определение колонки: {line}")
+    def save_checkpoint():
+        # Контрольная точка только на границе строк, когда все пачки уже записаны
+        flush_batch(drain=True)
+        state = {
+            "input_offset": input_offset,
+            "output_offset": output.position(),
+            "tables": tables,
+            "current_table": current_table,
+            "creation_lines": creation_lines,
+            "enum_types": enum_types,
+            "foreign_key_lines": foreign_key_lines,
+            "fulltext_key_lines": fulltext_key_lines,
+            "sequence_lines": sequence_lines,
+            "cast_lines": cast_lines,
+            "num_inserts": num_inserts,
+            "copy_table": copy_table,
+            "copy": copy,
+            "include": table_filter.include,
+            "exclude": table_filter.exclude,
+        }
+        with open(checkpoint_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+    # Пул создаётся после открытия входа и выхода: ошибка там не оставляет лишних процессов
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        next_checkpoint = time.monotonic() + checkpoint_interval
+        for line in input_fh:
+            if checkpoint and time.monotonic() >= next_checkpoint:
+                save_checkpoint()
+                next_checkpoint = time.monotonic() + checkpoint_interval
+            input_offset += len(line)
+            # Данные ненужных таблиц отбрасываются до декодирования и любой обработки строки
+            if table_filter and current_table is None and line.startswith(b"INSERT INTO"):
+                match = INSERT_TABLE_BYTES_RE.match(line)
+                if match and not table_filter.wanted(match.group(1).decode("utf-8")):
                     continue
+            line = line.decode("utf-8")
+            progress.update(len(tables), num_inserts)
+
+            # INSERT копятся в пачку, остальное разбирается здесь после записи всех пачек до него
+            if current_table is None and line.startswith("INSERT INTO"):
+                batch.append(line)
+                batch_size += len(line)
+                if batch_size >= PARALLEL_BATCH_SIZE or pool is None:
+                    flush_batch()
+                continue
+            flush_batch(drain=True)
+
+            # В Python 3 line уже str, decode не нужен
+            line = fix_escapes(line)
+
+            # Игнорируем комментарии и служебные строки
+            if line.startswith("--") or line.startswith("/*") or line.startswith("LOCK TABLES") or line.startswith("DROP TABLE") or line.startswith("UNLOCK TABLES") or not line:
+                continue
+
+            # Блок COPY закрывается перед любой строкой, кроме INSERT
+            if copy_table is not None and not line.startswith("INSERT INTO"):
+                output.copy_end()
+                copy_table = None
+
+            # Обработка состояния
+            if current_table is None:
+                if line.startswith("CREATE TABLE"):
+                    # Получаем имя таблицы из кавычек
+                    # В MySQL дампе имя может быть в обратных кавычках ` или двойных "
+                    # Попробуем универсально
+                    match = CREATE_TABLE_RE.search(line)
+                    if match:
+                        current_table = match.group(1)
+                        # Отфильтрованная таблица не попадает в tables, её тело пропускается до ");"
+                        if table_filter.wanted(current_table):
+                            tables[current_table] = {"columns": []}
+                        creation_lines = []
+                    else:
+                        print(f"\n ! Не удалось определить имя таблицы в строке: {line}", file=sys.stderr)
+                elif line.startswith("INSERT INTO"):
+                    match = INSERT_TABLE_RE.match(line)
+                    if not match or table_filter.wanted(match.group(1)):
+                        write_converted([convert_insert(line, copy)])
+                else:
+                    # Можно убрать или оставить для отладки
+                    # print(f"\n ! Unknown line in main body: {line}")
+                    pass
 
-                try:
-                    type_part, extra_part = definition.split(" ", 1)
-                except ValueError:
-                    type_part = definition
-                    extra_part = ""
-
-                extra_part = re.sub(r"CHARACTER SET [\w\d]+\s*", "", extra_part.replace("unsigned", ""))
-                extra_part = re.sub(r"COLLATE [\w\d]+\s*", "", extra_part.replace("unsigned", ""))
-
-                # Преобразование типов
-                final_type = None
-                set_sequence = None
-                type_lower = type_part.lower()
-                if type_lower.startswith("tinyint("):
-                    type_part = "int4"
-                    set_sequence = True
-                    final_type = "boolean"
-                elif type_lower.startswith("int("):
-                    type_part = "integer"
-                    set_sequence = True
-                elif type_lower.startswith("bigint("):
-                    type_part = "bigint"
-                    set_sequence = True
-                elif type_lower == "longtext":
-                    type_part = "text"
-                elif type_lower == "mediumtext":
-                    type_part = "text"
-                elif type_lower == "tinytext":
-                    type_part = "text"
-                elif type_lower.startswith("varchar("):
-                    size = int(re.search(r'\((\d+)\)', type_part).group(1))
-                    type_part = f"varchar({size * 2})"
-                elif type_lower.startswith("smallint("):
-                    type_part = "int2"
-                    set_sequence = True
-                elif type_lower == "datetime":
-                    type_part = "timestamp with time zone"
-                elif type_lower == "double":
-                    type_part = "double precision"
-                elif type_lower.endswith("blob"):
-                    type_part = "bytea"
-                elif type_lower.startswith("enum(") or type_lower.startswith("set("):
-                    types_str = type_part.split("(",1)[1].rstrip(")").rstrip('"')
-                    types_arr = [t.strip("'") for t in types_str.split(",")]
-                    enum_name = f"{current_table}_{name}"
-                    if enum_name not in enum_types:
-                        output.write(f"CREATE TYPE {enum_name} AS ENUM ({types_str}); \n")
-                        enum_types.append(enum_name)
-                    type_part = enum_name
-
-                if final_type:
-                    cast_lines.append(f"ALTER TABLE \"{current_table}\" ALTER COLUMN \"{name}\" DROP DEFAULT, ALTER COLUMN \"{name}\" TYPE {final_type} USING CAST(\"{name}\" as {final_type})")
-                if name == "id" and set_sequence:
-                    sequence_lines.append(f"CREATE SEQUENCE {current_table}_id_seq")
-                    sequence_lines.append(f"SELECT setval('{current_table}_id_seq', max(id)) FROM {current_table}")
-                    sequence_lines.append(f"ALTER TABLE \"{current_table}\" ALTER COLUMN \"id\" SET DEFAULT nextval('{current_table}_id_seq')")
-
-                creation_lines.append(f'"{name}" {type_part} {extra_part}')
-                tables[current_table]['columns'].append((name, type_part, extra_part))
-
-            elif line.startswith("PRIMARY KEY"):
-                creation_lines.append(line.rstrip(","))
-            elif line.startswith("CONSTRAINT"):
-                foreign_key_lines.append(f"ALTER TABLE \"{current_table}\" ADD CONSTRAINT {line.split('CONSTRAINT')[1].strip().rstrip(',')} DEFERRABLE INITIALLY DEFERRED")
-                foreign_key_lines.append(f"CREATE INDEX ON \"{current_table}\" {line.split('FOREIGN KEY')[1].split('REFERENCES')[0].strip().rstrip(',')}")
-            elif line.startswith("UNIQUE KEY"):
-                creation_lines.append(f"UNIQUE ({line.split('(')[1].split(')')[0]})")
-            elif line.startswith("FULLTEXT KEY"):
-                fulltext_keys = " || ' ' || ".join(line.split('(')[-1].split(')')[0].replace('"', '').split(','))
-                fulltext_key_lines.append(f"CREATE INDEX ON {current_table} USING gin(to_tsvector('english', {fulltext_keys}))")
-            elif line.startswith("KEY"):
-                pass
-            elif line == ");":
-                output.write(f"CREATE TABLE \"{current_table}\" (\n")
-                for idx, l in enumerate(creation_lines):
-                    output.write(f"    {l}{',' if idx != len(creation_lines) - 1 else ''}\n")
-                output.write(");\n\n")
-                current_table = None
             else:
-                print(f"\n ! Unknown line inside table creation: {line}")
+                # Внутри CREATE TABLE
+                if current_table not in tables:
+                    if line == ");":
+                        current_table = None
+                elif line.startswith('"') or line.startswith('`'):
+                    # Разбор колонки
+                    # Убираем начальные и конечные кавычки, разделяем по пробелу
+                    parts = re.split(r'"|`', line.strip(","))
+                    if len(parts) >= 3:
+                        name = parts[1]
+                        definition = parts[2].strip()
+                    else:
+                        print(f"\n ! Не удалось разобрать определение колонки: {line}", file=sys.stderr)
+                        continue
 
-    # Завершение файла
-    output.write("\n-- Post-data save --\n")
-    output.write("COMMIT;\n")
-    output.write("START TRANSACTION;\n")
+                    try:
+                        type_part, extra_part = definition.split(" ", 1)
+                    except ValueError:
+                        type_part = definition
+                        extra_part = ""
 
-    output.write("\n-- Typecasts --\n")
-    for line in cast_lines:
-        output.write(f"{line};\n")
+                    extra_part = re.sub(r"CHARACTER SET [\w\d]+\s*", "", extra_part.replace("unsigned", ""))
+                    extra_part = re.sub(r"COLLATE [\w\d]+\s*", "", extra_part.replace("unsigned", ""))
 
-    output.write("\n-- Foreign keys --\n")
-    for line in foreign_key_lines:
-        output.write(f"{line};\n")
+                    # Преобразование типов
+                    final_type = None
+                    set_sequence = None
+                    type_lower = type_part.lower()
+                    if type_lower.startswith("tinyint("):
+                        type_part = "int4"
+                        set_sequence = True
+                        final_type = "boolean"
+                    elif type_lower.startswith("int("):
+                        type_part = "integer"
+                        set_sequence = True
+                    elif type_lower.startswith("bigint("):
+                        type_part = "bigint"
+                        set_sequence = True
+                    elif type_lower == "longtext":
+                        type_part = "text"
+                    elif type_lower == "mediumtext":
+                        type_part = "text"
+                    elif type_lower == "tinytext":
+                        type_part = "text"
+                    elif type_lower.startswith("varchar("):
+                        size = int(re.search(r'\((\d+)\)', type_part).group(1))
+                        type_part = f"varchar({size * 2})"
+                    elif type_lower.startswith("smallint("):
+                        type_part = "int2"
+                        set_sequence = True
+                    elif type_lower == "datetime":
+                        type_part = "timestamp with time zone"
+                    elif type_lower == "double":
+                        type_part = "double precision"
+                    elif type_lower.endswith("blob"):
+                        type_part = "bytea"
+                    elif type_lower.startswith("enum(") or type_lower.startswith("set("):
+                        types_str = type_part.split("(",1)[1].rstrip(")").rstrip('"')
+                        types_arr = [t.strip("'") for t in types_str.split(",")]
+                        enum_name = f"{current_table}_{name}"
+                        if enum_name not in enum_types:
+                            output.statement(f"CREATE TYPE {enum_name} AS ENUM ({types_str}); \n")
+                            enum_types.append(enum_name)
+                        type_part = enum_name
 
-    output.write("\n-- Sequences --\n")
-    for line in sequence_lines:
-        output.write(f"{line};\n")
+                    if final_type:
+                        cast_lines.append(f"ALTER TABLE \"{current_table}\" ALTER COLUMN \"{name}\" DROP DEFAULT, ALTER COLUMN \"{name}\" TYPE {final_type} USING CAST(\"{name}\" as {final_type})")
+                    if name == "id" and set_sequence:
+                        sequence_lines.append(f"CREATE SEQUENCE {current_table}_id_seq")
+                        sequence_lines.append(f"SELECT setval('{current_table}_id_seq', max(id)) FROM {current_table}")
+                        sequence_lines.append(f"ALTER TABLE \"{current_table}\" ALTER COLUMN \"id\" SET DEFAULT nextval('{current_table}_id_seq')")
 
-    output.write("\n-- Full Text keys --\n")
-    for line in fulltext_key_lines:
-        output.write(f"{line};\n")
+                    creation_lines.append(f'"{name}" {type_part} {extra_part}')
+                    tables[current_table]['columns'].append((name, type_part, extra_part))
 
-    output.write("\nCOMMIT;\n")
-    print("Conversion complete.")
+                elif line.startswith("PRIMARY KEY"):
+                    creation_lines.append(line.rstrip(","))
+                elif line.startswith("CONSTRAINT"):
+                    # Внешний ключ на отфильтрованную таблицу не создаём, индекс по колонке оставляем
+                    match = REFERENCES_RE.search(line)
+                    if not match or table_filter.wanted(match.group(1)):
+                        foreign_key_lines.append(f"ALTER TABLE \"{current_table}\" ADD CONSTRAINT {line.split('CONSTRAINT')[1].strip().rstrip(',')} DEFERRABLE INITIALLY DEFERRED")
+                    foreign_key_lines.append(f"CREATE INDEX ON \"{current_table}\" {line.split('FOREIGN KEY')[1].split('REFERENCES')[0].strip().rstrip(',')}")
+                elif line.startswith("UNIQUE KEY"):
+                    creation_lines.append(f"UNIQUE ({line.split('(')[1].split(')')[0]})")
+                elif line.startswith("FULLTEXT KEY"):
+                    fulltext_keys = " || ' ' || ".join(line.split('(')[-1].split(')')[0].replace('"', '').split(','))
+                    fulltext_key_lines.append(f"CREATE INDEX ON {current_table} USING gin(to_tsvector('english', {fulltext_keys}))")
+                elif line.startswith("KEY"):
+                    pass
+                elif line == ");":
+                    create_sql = f"CREATE TABLE \"{current_table}\" (\n"
+                    for idx, l in enumerate(creation_lines):
+                        create_sql += f"    {l}{',' if idx != len(creation_lines) - 1 else ''}\n"
+                    output.statement(create_sql + ");\n\n")
+                    current_table = None
+                else:
+                    print(f"\n ! Unknown line inside table creation: {line}", file=sys.stderr)
+
+        flush_batch(drain=True)
+    except BaseException:
+        # Не дожидаемся пачек, которые уже не будут записаны
+        if pool:
+            pool.terminate()
+            pool.join()
+        raise
+    if pool:
+        pool.close()
+        pool.join()
+    progress.update(len(tables), num_inserts, force=True)
+    input_fh.close()
+    reader.close()
+    if copy_table is not None:
+        output.copy_end()
+
+    # Завершение файла
+    output.post_data(cast_lines, foreign_key_lines, sequence_lines, fulltext_key_lines)
+    output.close()
+    if checkpoint and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    logging.write("\nConversion complete.\n")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python tes.py input_mysql_dump.sql output_postgres_dump.sql")
-        sys.exit(1)
-    parse(sys.argv[1], sys.argv[2])
+    parser = argparse.ArgumentParser(description="Convert a MySQL dump into a PostgreSQL one")
+    parser.add_argument("input", help="input_mysql_dump.sql (.gz/.zst) or - for stdin")
+    parser.add_argument("output", nargs="?", help="output_postgres_dump.sql (.gz/.zst) or - for stdout")
+    parser.add_argument("--copy", action="store_true",
+                        help="write table data as COPY ... FROM stdin blocks instead of INSERT statements")
+    parser.add_argument("--dsn", help="load straight into this PostgreSQL database instead of writing a file "
+                                      "(implies --copy), e.g. 'dbname=target user=postgres'")
+    parser.add_argument("--split", action="store_true",
+                        help="write a directory (pre-data, per-table data, grouped post-data, manifest.json) "
+                             "for parallel restore instead of a single file (implies --copy)")
+    parser.add_argument("--restore", action="store_true",
+                        help="restore a --split directory given as input into --dsn using --workers psql jobs")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="convert INSERT lines in this many processes, or psql jobs for --restore (default: 1)")
+    parser.add_argument("--checkpoint", action="store_true",
+                        help="periodically save conversion state to <output>.checkpoint so it can be resumed")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL,
+                        help=f"seconds between checkpoints (default: {CHECKPOINT_INTERVAL:.0f})")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted --checkpoint conversion from <output>.checkpoint")
+    parser.add_argument("--include", action="append", metavar="PATTERN",
+                        help="convert only tables matching this fnmatch pattern (repeatable)")
+    parser.add_argument("--exclude", action="append", metavar="PATTERN",
+                        help="skip tables matching this fnmatch pattern (repeatable)")
+    parser.add_argument("--decompress-thread", action="store_true",
+                        help="decompress input in a background thread, overlapping it with conversion")
+    args = parser.parse_args()
+    if args.restore:
+        if not args.dsn or args.output:
+            parser.error("--restore takes a --split directory and --dsn")
+        restore_split(args.input, args.dsn, args.workers)
+        sys.exit(0)
+    if bool(args.output) == bool(args.dsn):
+        parser.error("give either an output file or --dsn")
+    if args.dsn and psycopg2 is None:
+        parser.error("--dsn requires psycopg2")
+    if args.split and (args.dsn or args.output == "-"):
+        parser.error("--split needs an output directory")
+    if (args.checkpoint or args.resume) and (args.dsn or args.split or args.output == "-"
+                                             or args.output.endswith((".gz", ".zst", ".zstd"))):
+        parser.error("--checkpoint and --resume need an uncompressed output file")
+    parse(args.input, args.output, copy=args.copy, dsn=args.dsn, workers=args.workers,
+          decompress_thread=args.decompress_thread, split=args.split, checkpoint=args.checkpoint,
+          resume=args.resume, checkpoint_interval=args.checkpoint_interval, include=args.include,
+          exclude=args.exclude)
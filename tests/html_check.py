@@ -1,10 +1,23 @@
+import io
 import os
 import re
+import ast
 import sys
-import importlib.util
+import json
+import time
+import queue
+import tokenize
+import ftplib
+import socket
+import sqlite3
 import datetime
+import threading
+import http.client
 import requests
-from unittest import mock
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib.parse import urlparse
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
@@ -13,6 +26,27 @@ PARSERS_DIR = os.path.join(PROJECT_ROOT, '../Parsers/parsers')
 URL_PATTERN = re.compile(r"(?:http|https|ftp)://[\w\-./?&=%]+")
 SIMPLE_URL_PATTERN = re.compile(r"['\"]((?:http|https|ftp)://[^'\"\\s]+)['\"]")
 F_STRING_PATTERN = re.compile(r"f(['\"])(.*?)\1", re.DOTALL)
+FULL_URL_PATTERN = re.compile(r"(?:http|https|ftp)://[^\s'\"<>]+")
+# Знаки, которые в тексте стоят после ссылки, а не входят в неё
+URL_TRAILING_PUNCTUATION = ".,;:)]}"
+LOCAL_URL_PATTERN = re.compile(
+    r"^(http|https|ftp)://(localhost|127\.\d+\.\d+\.\d+|192\.168\.\d+\.\d+|10\.\d+\.\d+\.\d+|172\.(1[6-9]|2\d|3[0-1])\.\d+\.\d+)")
+
+REQUEST_TIMEOUT = 10
+MAX_WORKERS = 16
+# Минимальный интервал между запросами к одному хосту, чтобы поставщики данных не ограничивали нас
+HOST_MIN_INTERVAL = 0
+# Бот ждёт скрипт не дольше 300 с, оставляем запас на разбор парсеров и вывод
+CHECK_DEADLINE = 240
+DEADLINE_MESSAGE = "Не проверено: истёк общий лимит времени"
+
+INDEX_FILE = os.path.join(CURRENT_DIR, 'html_check_index.json')
+# Меняется вместе с правилами извлечения ссылок: записи индекса другой версии разбираются заново
+INDEX_VERSION = 3
+CACHE_FILE = os.path.join(CURRENT_DIR, 'html_check_cache.sqlite3')
+CACHE_OK_TTL = 6 * 3600
+CACHE_FAIL_TTL = 15 * 60
+CACHE_MAX_ENTRIES = 5000
 
 FAKE_VALUES = {
     'station_iaga': 'TEST',
@@ -28,6 +62,12 @@ FAKE_VALUES = {
     'until_year': '2025',
 }
 
+# Даты, с которыми вычисляется build_url
+TEST_SINCE_DATE = datetime.date(2023, 1, 1)
+TEST_UNTIL_DATE = datetime.date(2023, 1, 2)
+# Методы, которые можно вызвать при статическом вычислении build_url
+SAFE_METHODS = {'format', 'strftime', 'isoformat', 'replace', 'strip', 'lstrip', 'rstrip', 'lower', 'upper', 'join'}
+
 
 def substitute_fstring(fstring):
     def replacer(match):
@@ -37,69 +77,566 @@ def substitute_fstring(fstring):
     return re.sub(r"\{(\w+)\}", replacer, fstring)
 
 
-def extract_urls_from_file(filepath):
+def extract_urls_with_regex(content):
     urls = set()
+    urls.update(URL_PATTERN.findall(content))
+    urls.update(SIMPLE_URL_PATTERN.findall(content))
+
+    fstrings = F_STRING_PATTERN.findall(content)
+    for _, fstr in fstrings:
+        substituted = substitute_fstring(fstr)
+        urls.update(URL_PATTERN.findall(substituted))
+    return urls
+
+
+class StaticEvalError(Exception):
+    pass
+
+
+def static_eval(node, env):
+    "Вычисляет простое выражение из AST без импорта модуля: строки, f-строки, +, %, format, strftime"
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Name):
+        if node.id in env:
+            return env[node.id]
+        raise StaticEvalError(node.id)
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.Constant):
+                parts.append(value.value)
+                continue
+            result = static_eval(value.value, env)
+            if value.conversion == ord('r'):
+                result = repr(result)
+            elif value.conversion in (ord('s'), ord('a')):
+                result = str(result) if value.conversion == ord('s') else ascii(result)
+            spec = static_eval(value.format_spec, env) if value.format_spec else ''
+            parts.append(format(result, spec))
+        return ''.join(parts)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        left, right = static_eval(node.left, env), static_eval(node.right, env)
+        if not isinstance(left, str):
+            raise StaticEvalError("нестроковая операция")
+        return left + right if isinstance(node.op, ast.Add) else left % right
+    if isinstance(node, ast.Tuple):
+        return tuple(static_eval(e, env) for e in node.elts)
+    if isinstance(node, ast.Call) and not any(isinstance(a, ast.Starred) for a in node.args):
+        args = [static_eval(a, env) for a in node.args]
+        if any(k.arg is None for k in node.keywords):
+            raise StaticEvalError("**kwargs")
+        kwargs = {k.arg: static_eval(k.value, env) for k in node.keywords}
+        if isinstance(node.func, ast.Attribute) and node.func.attr in SAFE_METHODS:
+            obj = static_eval(node.func.value, env)
+            if isinstance(obj, (str, datetime.date)):
+                return getattr(obj, node.func.attr)(*args, **kwargs)
+        elif isinstance(node.func, ast.Name) and node.func.id == 'str' and len(args) == 1 and not kwargs:
+            return str(args[0])
+    raise StaticEvalError(type(node).__name__)
+
+
+def render_fstring(node):
+    "Подставляет в f-строку FAKE_VALUES по именам переменных, остальное заменяет на TEST"
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(str(value.value))
+        elif isinstance(value.value, ast.Name):
+            parts.append(FAKE_VALUES.get(value.value.id, 'TEST'))
+        else:
+            parts.append('TEST')
+    return ''.join(parts)
+
+
+def eval_build_url(func, env):
+    "Вычисляет тело build_url из присваиваний и return для тестовых дат"
+    env = dict(env)
+    params = [a.arg for a in func.args.posonlyargs + func.args.args]
+    if len(params) < 2:
+        return None
+    defaults = func.args.defaults
+    for name, default in zip(params[len(params) - len(defaults):], defaults):
+        env[name] = static_eval(default, env)
+    env[params[0]], env[params[1]] = TEST_SINCE_DATE, TEST_UNTIL_DATE
+    for stmt in func.body:
+        if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant):
+            continue
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+            env[stmt.targets[0].id] = static_eval(stmt.value, env)
+        elif isinstance(stmt, ast.Return) and stmt.value is not None:
+            return static_eval(stmt.value, env)
+        else:
+            raise StaticEvalError(type(stmt).__name__)
+    return None
+
+
+def extract_urls_from_source(content):
+    """Ищет ссылки по AST: строковые константы, f-строки, BASE_URL, BASE_URL_TEMPLATE и build_url.
+
+    Модуль не импортируется, поэтому побочных эффектов и записей в sys.modules нет.
+    Ссылки из докстрингов и комментариев тоже проверяются, как и при разборе регулярными
+    выражениями.
+    """
+    tree = ast.parse(content)
+    texts = []
+    fstring_parts = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            texts.append(render_fstring(node))
+            fstring_parts.update(id(v) for v in node.values)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fstring_parts:
+            # Шаблоны для str.format заполняются так же, как f-строки
+            texts.append(substitute_fstring(node.value))
+
+    # Значения модульных констант, в том числе собранные из других констант
+    env = {}
+    for stmt in tree.body:
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+            try:
+                env[stmt.targets[0].id] = static_eval(stmt.value, env)
+            except Exception:
+                pass
+    if isinstance(env.get('BASE_URL'), str):
+        texts.append(env['BASE_URL'])
+    if isinstance(env.get('BASE_URL_TEMPLATE'), str):
+        try:
+            texts.append(env['BASE_URL_TEMPLATE'].format(**FAKE_VALUES))
+        except Exception:
+            pass
+    for stmt in tree.body:
+        if isinstance(stmt, ast.FunctionDef) and stmt.name == 'build_url':
+            try:
+                url = eval_build_url(stmt, env)
+                if isinstance(url, str):
+                    texts.append(url)
+            except Exception:
+                pass
+
+    # Комментариев нет в AST: берём их из токенов
+    for token in tokenize.generate_tokens(io.StringIO(content).readline):
+        if token.type == tokenize.COMMENT:
+            texts.append(token.string)
+
+    urls = set()
+    for text in texts:
+        urls.update(url.rstrip(URL_TRAILING_PUNCTUATION) for url in FULL_URL_PATTERN.findall(text))
+    return urls
+
+
+def extract_urls_from_file(filepath):
     with open(filepath, encoding='utf-8') as f:
         content = f.read()
+    try:
+        urls = extract_urls_from_source(content)
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        urls = extract_urls_with_regex(content)
 
-        urls.update(URL_PATTERN.findall(content))
-        urls.update(SIMPLE_URL_PATTERN.findall(content))
+    urls = {url for url in urls if 'proxy' not in url.lower()}
 
-        fstrings = F_STRING_PATTERN.findall(content)
-        for _, fstr in fstrings:
-            substituted = substitute_fstring(fstr)
-            urls.update(URL_PATTERN.findall(substituted))
+    return urls
 
-    urls = {url for url in urls if 'proxy' not in url.lower()}
 
+def load_url_index(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_url_index(path, index):
+    # Своё временное имя у каждого процесса и потока: параллельные запуски не пишут в один файл
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def get_file_urls(filepath, index):
+    "Ссылки файла из индекса, если не изменились mtime и размер, иначе заново разбирает файл"
+    st = os.stat(filepath)
+    entry = index.get(filepath)
+    if entry and entry.get('version') == INDEX_VERSION \
+            and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+        return set(entry['urls'])
+    urls = extract_urls_from_file(filepath)
+    index[filepath] = {'version': INDEX_VERSION, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size,
+                       'urls': sorted(urls)}
     return urls
 
 
-def check_url(url):
+def probe_http(session, url, timeout, validators=None):
+    """HEAD, а при ошибке - GET одного байта. Возвращает (ok, msg, validators).
+
+    validators - ETag и Last-Modified прошлого удачного ответа: с ними запрос условный,
+    и 304 означает, что ресурс на месте и не менялся.
+    """
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    resp = session.head(url, timeout=time_left(timeout), allow_redirects=True, headers=headers)
+    resp.close()
+    if resp.status_code == 304:
+        return True, "HTTP 304, без изменений", validators
+    if resp.status_code >= 400:
+        # Не все серверы отвечают на HEAD: запрашиваем один байт вместо полного скачивания
+        resp = session.get(url, timeout=time_left(timeout), headers={'Range': 'bytes=0-0'}, stream=True)
+        resp.close()
+    ok = resp.ok or resp.status_code == 416
+    new_validators = None
+    if ok and (resp.headers.get('ETag') or resp.headers.get('Last-Modified')):
+        new_validators = {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+    return ok, f"HTTP {resp.status_code}", new_validators
+
+
+class RequestTimeout(Exception):
+    "Запрос не уложился в отведённое ему общее время"
+
+
+# Срок запроса, который сейчас выполняет поток: все его чтения из сокета идут в этом же потоке
+request_deadline = threading.local()
+
+
+def time_left(timeout=None):
+    "Время до срока запроса потока, не больше timeout; TimeoutError, если срок истёк"
+    deadline = getattr(request_deadline, 'value', None)
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("Истёк срок запроса")
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+class DeadlineReader(io.RawIOBase):
+    """Чтение из сокета, где таймаут каждого recv обрезан до срока запроса.
+
+    timeout requests и ftplib действует на каждое чтение, и сервер, отдающий ответ по
+    байту, держит запрос сколько угодно. Через этот поток читаются заголовки HTTP и
+    ответы FTP, так что запрос не переживает request_deadline без лишних потоков.
+    """
+
+    def __init__(self, raw, sock):
+        self.raw = raw
+        self.sock = sock
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if getattr(request_deadline, 'value', None) is not None:
+            self.sock.settimeout(time_left())
+        return self.raw.readinto(b)
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+class DeadlineHTTPResponse(http.client.HTTPResponse):
+    def __init__(self, sock, *args, **kwargs):
+        super().__init__(sock, *args, **kwargs)
+        self.fp = io.BufferedReader(DeadlineReader(self.fp.detach(), sock))
+
+
+class DeadlineHTTPConnection(HTTPConnection):
+    response_class = DeadlineHTTPResponse
+
+
+class DeadlineHTTPSConnection(HTTPSConnection):
+    response_class = DeadlineHTTPResponse
+
+
+class DeadlineHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = DeadlineHTTPConnection
+
+
+class DeadlineHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = DeadlineHTTPSConnection
+
+
+class DeadlineAdapter(HTTPAdapter):
+    "HTTPAdapter, ответы которого читаются через DeadlineReader"
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': DeadlineHTTPConnectionPool,
+                                                   'https': DeadlineHTTPSConnectionPool}
+
+
+class DeadlineFTP(ftplib.FTP):
+    "FTP, ответы которого читаются через DeadlineReader"
+
+    def connect(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.sock = socket.create_connection((host, port), timeout)
+        self.af = self.sock.family
+        raw = DeadlineReader(self.sock.makefile('rb', buffering=0), self.sock)
+        self.file = io.TextIOWrapper(io.BufferedReader(raw), encoding=self.encoding)
+        self.welcome = self.getresp()
+        return self.welcome
+
+
+class HostChecker:
+    """Проверяет ссылки одного хоста через одно переиспользуемое соединение.
+
+    Для HTTP(S) это keep-alive сессия с пулом в одно соединение, для FTP - одно
+    FTP-соединение, которое проверяется командой NOOP. min_interval задаёт паузу
+    между запросами к хосту.
+    """
+
+    def __init__(self, min_interval=HOST_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.session = None
+        self.ftp = None
+        self.last_request = None
+
+    def wait_turn(self, deadline):
+        "Выдерживает min_interval; False, если пауза не укладывается в deadline"
+        if self.min_interval and self.last_request is not None:
+            delay = self.last_request + self.min_interval - time.monotonic()
+            if delay > 0:
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    return False
+                time.sleep(delay)
+        self.last_request = time.monotonic()
+        return True
+
+    def probe_ftp(self, parsed, timeout):
+        if self.ftp is not None:
+            try:
+                self.ftp.voidcmd('NOOP')
+                return True, "FTP OK", None
+            except (OSError, EOFError, ftplib.Error):
+                # Сервер закрыл соединение: подключаемся заново
+                self.ftp.close()
+                self.ftp = None
+        self.ftp = DeadlineFTP()
+        self.ftp.connect(parsed.hostname, parsed.port or 21, time_left(timeout))
+        return True, "FTP OK", None
+
+    def check(self, url, timeout, validators=None):
+        "Проверяет ссылку не дольше timeout секунд в сумме"
+        deadline = time.monotonic() + timeout
+        request_deadline.value = deadline
+        try:
+            return self.probe(url, timeout, validators)
+        except Exception:
+            if time.monotonic() < deadline:
+                raise
+            # Соединение, не уложившееся в срок, закрываем без QUIT и бросаем: следующая
+            # ссылка хоста пойдёт через новое
+            if self.session is not None:
+                self.session.close()
+            if self.ftp is not None:
+                self.ftp.close()
+            self.session = self.ftp = None
+            raise RequestTimeout(f"Нет ответа за {timeout:.1f} с")
+        finally:
+            request_deadline.value = None
+
+    def probe(self, url, timeout, validators=None):
+        parsed = urlparse(url)
+        if parsed.scheme == 'ftp':
+            return self.probe_ftp(parsed, timeout)
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = DeadlineAdapter(pool_connections=1, pool_maxsize=1)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+        return probe_http(self.session, url, timeout, validators)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except Exception:
+                self.ftp.close()
+
+
+def check_url(url, deadline=None, validators=None, checker=None):
     if 'proxy' in url.lower():
-        return None, "Пропущена ссылка с proxy"
+        return None, "Пропущена ссылка с proxy", None
 
+    own_checker = checker is None
+    if own_checker:
+        checker = HostChecker()
     try:
-        if re.match(
-                r"^(http|https|ftp)://(localhost|127\.\d+\.\d+\.\d+|192\.168\.\d+\.\d+|10\.\d+\.\d+\.\d+|172\.(1[6-9]|2\d|3[0-1])\.\d+\.\d+)",
-                url):
-            return None, "Пропущена локальная ссылка"
-
-        if url.startswith('ftp://'):
-            import ftplib
-            from urllib.parse import urlparse
-            parsed = urlparse(url)
-            ftp = ftplib.FTP()
-            ftp.connect(parsed.hostname, parsed.port or 21, timeout=10)
-            ftp.quit()
-            return True, "FTP OK"
-        else:
-            resp = requests.get(url, timeout=10)
-            return resp.ok, f"HTTP {resp.status_code}"
+        if LOCAL_URL_PATTERN.match(url):
+            return None, "Пропущена локальная ссылка", None
+
+        if not checker.wait_turn(deadline):
+            return False, DEADLINE_MESSAGE, None
+        timeout = REQUEST_TIMEOUT
+        clipped = deadline is not None and deadline - time.monotonic() < timeout
+        if clipped:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return False, DEADLINE_MESSAGE, None
+
+        return checker.check(url, timeout, validators)
+    except RequestTimeout as e:
+        # Запрос, обрезанный общим лимитом, считается непроверенным, а не упавшим
+        return False, DEADLINE_MESSAGE if clipped else str(e), None
     except Exception as e:
-        return False, str(e)
-
-
-def load_parser_module(parser_path):
-    with mock.patch.dict(sys.modules, {
-        'bs4': mock.MagicMock(),
-        'psycopg2.extras': mock.MagicMock(),
-        'psycopg2': mock.MagicMock(),
-        'modules': mock.MagicMock(),
-        'modules.postgres': mock.MagicMock(),
-        'modules.redis': mock.MagicMock(),
-        'modules.logger_setup': mock.MagicMock(),
-        'modules.utils': mock.MagicMock(),
-        'modules.proxy': mock.MagicMock(),
-    }):
-        spec = importlib.util.spec_from_file_location("parser_module", parser_path)
-        module = importlib.util.module_from_spec(spec)
-        sys.modules["parser_module"] = module
-        spec.loader.exec_module(module)
-        return module
-
-
-def main():
+        return False, str(e), None
+    finally:
+        if own_checker:
+            checker.close()
+
+
+def host_key(url):
+    parsed = urlparse(url)
+    try:
+        port = parsed.port
+    except ValueError:
+        port = None
+    return parsed.scheme, parsed.hostname, port
+
+
+def plan_checks(urls):
+    "Группирует уникальные ссылки по схеме и хосту: каждая группа проверяется через одно соединение"
+    groups = {}
+    for url in sorted(set(urls)):
+        groups.setdefault(host_key(url), []).append(url)
+    return groups
+
+
+class ResultCache:
+    """Кеш результатов check_url в SQLite.
+
+    У OK и FAIL свои TTL; просроченный OK с ETag/Last-Modified перепроверяется условным
+    запросом. Сверх max_entries вытесняются давно не запрошенные ссылки.
+    """
+
+    def __init__(self, path=CACHE_FILE, ok_ttl=CACHE_OK_TTL, fail_ttl=CACHE_FAIL_TTL,
+                 max_entries=CACHE_MAX_ENTRIES):
+        self.ok_ttl = ok_ttl
+        self.fail_ttl = fail_ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                url TEXT PRIMARY KEY,
+                ok INTEGER NOT NULL,
+                info TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                checked_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+
+    def lookup(self, urls):
+        "Возвращает (свежие результаты url -> (ok, msg), validators для просроченных OK)"
+        now = time.time()
+        fresh, validators = {}, {}
+        for url in urls:
+            row = self.conn.execute(
+                "SELECT ok, info, etag, last_modified, checked_at FROM results WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                continue
+            ok, info, etag, last_modified, checked_at = row
+            if now - checked_at < (self.ok_ttl if ok else self.fail_ttl):
+                fresh[url] = (bool(ok), f"{info} (кеш)")
+            elif ok and (etag or last_modified):
+                validators[url] = {'etag': etag, 'last_modified': last_modified}
+        self.conn.executemany("UPDATE results SET used_at = ? WHERE url = ?", [(now, url) for url in fresh])
+        self.conn.commit()
+        return fresh, validators
+
+    def store(self, results):
+        now = time.time()
+        rows = []
+        for url, (ok, info, validators) in results.items():
+            # Пропущенные и не успевшие до общего лимита ссылки не кешируем
+            if ok is None or info == DEADLINE_MESSAGE:
+                continue
+            validators = validators or {}
+            rows.append((url, int(ok), info, validators.get('etag'), validators.get('last_modified'), now, now))
+        self.conn.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.execute(
+            "DELETE FROM results WHERE url NOT IN (SELECT url FROM results ORDER BY used_at DESC LIMIT ?)",
+            (self.max_entries,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def check_urls(urls, deadline=CHECK_DEADLINE, cache=None, host_interval=HOST_MIN_INTERVAL):
+    """Проверяет ссылки не дольше deadline секунд: хосты параллельно, ссылки одного хоста подряд.
+
+    Возвращает словарь url -> (ok, msg); не успевшие ссылки получают FAIL с DEADLINE_MESSAGE.
+    С cache свежие результаты берутся из кеша, а новые сохраняются в него.
+    """
+    results, validators = cache.lookup(urls) if cache else ({}, {})
+    deadline_at = time.monotonic() + deadline
+    checked = {}
+
+    def check_host(host_urls):
+        checker = HostChecker(host_interval)
+        try:
+            for url in host_urls:
+                checked[url] = check_url(url, deadline_at, validators.get(url), checker)
+        finally:
+            checker.close()
+
+    groups = plan_checks(url for url in urls if url not in results)
+    pending = queue.Queue()
+    for host_urls in groups.values():
+        pending.put(host_urls)
+
+    def worker():
+        while time.monotonic() < deadline_at:
+            try:
+                host_urls = pending.get_nowait()
+            except queue.Empty:
+                return
+            check_host(host_urls)
+
+    # Потоки-демоны: в отличие от ThreadPoolExecutor их не ждут при выходе из процесса,
+    # так что запрос, висящий после общего лимита, не задерживает печать отчёта и выход
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(MAX_WORKERS, len(groups)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0, deadline_at - time.monotonic()))
+    checked = dict(checked)
+    for host_urls in groups.values():
+        for url in host_urls:
+            checked.setdefault(url, (False, DEADLINE_MESSAGE, None))
+    if cache:
+        cache.store(checked)
+    results.update({url: (ok, msg) for url, (ok, msg, _) in checked.items()})
+    return results
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Проверка ссылок в парсерах")
+    parser.add_argument('--index-file', default=INDEX_FILE, help="Файл индекса ссылок по файлам парсеров")
+    parser.add_argument('--reindex', action='store_true', help="Заново разобрать все файлы парсеров")
+    parser.add_argument('--refresh', action='store_true', help="Перепроверить все ссылки, не доверяя кешу")
+    parser.add_argument('--no-cache', action='store_true', help="Не читать и не сохранять кеш результатов")
+    parser.add_argument('--cache-file', default=CACHE_FILE, help="Файл кеша результатов (SQLite)")
+    parser.add_argument('--ok-ttl', type=int, default=CACHE_OK_TTL,
+                        help="Сколько секунд доверять успешной проверке")
+    parser.add_argument('--fail-ttl', type=int, default=CACHE_FAIL_TTL,
+                        help="Сколько секунд доверять неудачной проверке")
+    parser.add_argument('--host-interval', type=float, default=HOST_MIN_INTERVAL,
+                        help="Минимальная пауза в секундах между запросами к одному хосту")
+    args = parser.parse_args(argv)
+    if args.refresh:
+        # Свежих записей нет, но условные запросы по ETag/Last-Modified остаются
+        args.ok_ttl = args.fail_ttl = 0
+
     report = []
     if not os.path.exists(PARSERS_DIR):
         print(f"Папка с парсерами не найдена: {PARSERS_DIR}")
@@ -107,6 +644,9 @@ def main():
 
     print("Начинаем анализ парсеров и проверку ссылок...")
 
+    index = {} if args.reindex else load_url_index(args.index_file)
+    index_before = dict(index)
+    planned = []
     for parser_name in sorted(os.listdir(PARSERS_DIR)):
         parser_path = os.path.join(PARSERS_DIR, parser_name)
         if not os.path.isdir(parser_path):
@@ -115,44 +655,11 @@ def main():
         parser_py = os.path.join(parser_path, 'parser.py')
         urls_to_check = set()
 
-        if os.path.exists(parser_py):
-            try:
-                mod = load_parser_module(parser_py)
-
-                if hasattr(mod, 'build_url') and callable(mod.build_url):
-                    try:
-                        test_since_date = datetime.date(2023, 1, 1)
-                        test_until_date = datetime.date(2023, 1, 2)
-                        url = mod.build_url(test_since_date, test_until_date)
-                        if url:
-                            urls_to_check.add(url)
-                    except Exception:
-                        pass
-
-                if hasattr(mod, 'BASE_URL_TEMPLATE'):
-                    template = mod.BASE_URL_TEMPLATE
-                    try:
-                        url = template.format(**FAKE_VALUES)
-                        if url:
-                            urls_to_check.add(url)
-                    except Exception:
-                        pass
-
-                if hasattr(mod, 'BASE_URL') and isinstance(mod.BASE_URL, str) and mod.BASE_URL.startswith(
-                        ('http', 'ftp')):
-                    if 'BASE_URL_TEMPLATE' not in mod.__dict__ and 'build_url' not in mod.__dict__:
-                        urls_to_check.add(mod.BASE_URL)
-
-            except Exception:
-                if "parser_module" in sys.modules:
-                    del sys.modules["parser_module"]
-
         for root, _, files in os.walk(parser_path):
             for file in files:
                 if file.endswith('.py'):
                     file_path = os.path.join(root, file)
-                    extracted_urls = extract_urls_from_file(file_path)
-                    urls_to_check.update(extracted_urls)
+                    urls_to_check.update(get_file_urls(file_path, index))
 
         base_url_map = {}
         for url in urls_to_check:
@@ -167,8 +674,25 @@ def main():
             else:
                 filtered_urls.update(url_list)
 
-        for url in sorted(filtered_urls):
-            ok, msg = check_url(url)
+        planned.append((parser_name, parser_py, sorted(filtered_urls)))
+
+    # Удалённые файлы выпадают из индекса, сохраняем только при изменениях
+    index = {path: entry for path, entry in index.items() if os.path.exists(path)}
+    if index != index_before:
+        save_url_index(args.index_file, index)
+
+    # Все ссылки проверяются разом, а отчёт собирается в прежнем порядке: парсер, затем ссылка
+    cache = None if args.no_cache else ResultCache(args.cache_file, args.ok_ttl, args.fail_ttl)
+    try:
+        results = check_urls({url for _, _, urls in planned for url in urls}, cache=cache,
+                             host_interval=args.host_interval)
+    finally:
+        if cache:
+            cache.close()
+
+    for parser_name, parser_py, urls in planned:
+        for url in urls:
+            ok, msg = results[url]
             if ok is None:
                 continue
             report.append({
@@ -190,4 +714,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Долгоживущий воркер для бота: держит загруженными health_check и tests/html_check,
+тёплые соединения с БД и принимает задачи через Unix-сокет.
+
+Протокол - JSON по строкам. Запрос:
+    {"job": "health_check", "args": ["data", "--budget", "270"]}
+    {"job": "script", "name": "html_check"}
+Ответ - поток {"type": "line", "text": "..."} и в конце {"type": "done", "code": 0}.
+Строка {"type": "cancel"} от клиента или закрытие соединения отменяют задачу.
+
+Проверки health_check идут параллельно, каждая со своими настройками запуска и на
+своём соединении (из пула или, если пул занят, на отдельном). Отмена health_check
+прерывает текущий запрос к БД. Скрипты из PRELOADED_SCRIPTS выполняются в потоке
+воркера, и прервать их извне нельзя: отмена срабатывает при следующей их печати, а до
+тех пор поток задачи занимает одно из WORKER_THREADS мест пула. Остальные скрипты
+tests/ запускаются отдельным процессом, который отмена завершает сразу.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import subprocess
+import threading
+import traceback
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+import health_check
+
+SOCKET_PATH = os.environ.get('WORKER_SOCKET', '/tmp/tgbot-worker.sock')
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+PRELOADED_SCRIPTS = ['html_check']
+WORKER_THREADS = 8
+DB_POOL_SIZE = 4
+
+_job_local = threading.local()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class StreamRouter:
+    # Подменяет sys.stdout/sys.stderr: печать из потока задачи уходит клиенту этой задачи.
+    def __init__(self, default):
+        self.default = default
+
+    def write(self, text):
+        job = getattr(_job_local, 'job', None)
+        if job is None:
+            return self.default.write(text)
+        return job.write(text)
+
+    def flush(self):
+        if getattr(_job_local, 'job', None) is None:
+            self.default.flush()
+
+
+class Job:
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+        self.buffer = ""
+        self.cancelled = False
+        self.conn = None
+        self.process = None
+        self.code = 0
+
+    def emit(self, item):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def write(self, text):
+        if self.cancelled:
+            raise JobCancelled()
+        self.buffer += text
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            self.emit(line)
+        return len(text)
+
+    def cancel(self):
+        # health_check останавливается сразу по отмене запроса на его соединении, скрипт в
+        # отдельном процессе - по kill, а скрипт в потоке воркера - только на следующей
+        # печати (см. write).
+        self.cancelled = True
+        conn = self.conn
+        if conn is not None:
+            try:
+                conn.cancel()
+            except Exception:
+                pass
+        process = self.process
+        if process is not None:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def finish(self):
+        if self.buffer:
+            self.emit(self.buffer)
+            self.buffer = ""
+        self.emit(None)
+
+
+def load_scripts():
+    scripts = {}
+    for name in PRELOADED_SCRIPTS:
+        path = os.path.join(TESTS_DIR, f'{name}.py')
+        try:
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            scripts[name] = module
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить {path}: {e}")
+    return scripts
+
+
+def connect_pool():
+    from psycopg2.pool import ThreadedConnectionPool
+    try:
+        return ThreadedConnectionPool(1, DB_POOL_SIZE, health_check.DB_DSN)
+    except Exception as e:
+        print(f"[WARN] Нет тёплых соединений с БД, задачи будут подключаться сами: {e}")
+        return None
+
+
+def checkout_conn(pool):
+    """Живое соединение из пула или None, если свободных нет.
+
+    После перезапуска PostgreSQL в пуле остаются мёртвые соединения: такие закрываются,
+    и берётся следующее, пока пул не выдаст новое.
+    """
+    import psycopg2
+    from psycopg2.pool import PoolError
+    for _ in range(DB_POOL_SIZE + 1):
+        try:
+            conn = pool.getconn()
+        except PoolError:
+            return None
+        try:
+            if not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+                return conn
+        except psycopg2.Error:
+            pass
+        pool.putconn(conn, close=True)
+    return None
+
+
+def run_health_check(job, args, pool):
+    import psycopg2
+    conn = checkout_conn(pool) if pool is not None else None
+    pooled = conn is not None
+    if not pooled:
+        # Пул занят или недоступен: отдельное соединение, тоже видимое для Job.cancel
+        try:
+            conn = psycopg2.connect(health_check.DB_DSN)
+        except Exception as e:
+            print(f"[ERROR] Ошибка подключения к БД: {e}")
+            raise SystemExit(1)
+    job.conn = conn
+    try:
+        health_check.main(args, conn=conn)
+    finally:
+        job.conn = None
+        if not pooled:
+            conn.close()
+        else:
+            try:
+                conn.rollback()
+                pool.putconn(conn)
+            except Exception:
+                pool.putconn(conn, close=True)
+
+
+def run_script(job, name, scripts):
+    if name in scripts and hasattr(scripts[name], 'main'):
+        # Пустой argv: иначе argparse скрипта разберёт sys.argv самого воркера
+        scripts[name].main([])
+        return
+    path = os.path.join(TESTS_DIR, f'{name}.py')
+    if os.path.basename(name) != name or not os.path.exists(path):
+        print(f"Скрипт не найден: {name}")
+        raise SystemExit(1)
+    run_script_process(job, path)
+
+
+def run_script_process(job, path):
+    # Незагруженный скрипт - отдельным процессом: его можно убить при отмене, и он не
+    # делит с воркером sys.argv, модули и потоки.
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    process = subprocess.Popen([sys.executable, path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, env=env, encoding='utf-8', errors='replace')
+    job.process = process
+    if job.cancelled:
+        process.kill()
+    try:
+        for line in process.stdout:
+            print(line, end='')
+    finally:
+        job.process = None
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+    if job.cancelled:
+        raise JobCancelled()
+    if process.returncode:
+        raise SystemExit(process.returncode)
+
+
+def run_job(job, request, pool, scripts):
+    _job_local.job = job
+    try:
+        if request.get('job') == 'health_check':
+            run_health_check(job, request.get('args', []), pool)
+        elif request.get('job') == 'script':
+            run_script(job, request.get('name', ''), scripts)
+        else:
+            print(f"Неизвестная задача: {request.get('job')}")
+            job.code = 2
+    except JobCancelled:
+        job.code = 'cancelled'
+    except SystemExit as e:
+        job.code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception:
+        if job.cancelled:
+            job.code = 'cancelled'
+        else:
+            job.code = 1
+            try:
+                print(traceback.format_exc())
+            except JobCancelled:
+                pass
+    finally:
+        _job_local.job = None
+        job.finish()
+
+
+async def send(writer, message):
+    writer.write((json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8'))
+    await writer.drain()
+
+
+async def watch_cancel(reader, job):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            if json.loads(line).get('type') == 'cancel':
+                break
+        except ValueError:
+            continue
+    job.cancel()
+
+
+async def handle_client(reader, writer, executor, pool, scripts):
+    loop = asyncio.get_running_loop()
+    try:
+        request = json.loads(await reader.readline())
+    except ValueError:
+        await send(writer, {'type': 'done', 'code': 2, 'error': 'bad request'})
+        writer.close()
+        return
+
+    queue = asyncio.Queue()
+    job = Job(loop, queue)
+    loop.run_in_executor(executor, run_job, job, request, pool, scripts)
+    watcher = asyncio.ensure_future(watch_cancel(reader, job))
+    try:
+        while True:
+            line = await queue.get()
+            if line is None:
+                break
+            if not job.cancelled:
+                await send(writer, {'type': 'line', 'text': line})
+        await send(writer, {'type': 'done', 'code': job.code})
+    except ConnectionError:
+        job.cancel()
+    finally:
+        watcher.cancel()
+        writer.close()
+
+
+async def serve(socket_path=SOCKET_PATH):
+    scripts = load_scripts()
+    pool = connect_pool()
+    executor = ThreadPoolExecutor(WORKER_THREADS)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(
+        lambda r, w: handle_client(r, w, executor, pool, scripts), path=socket_path)
+    print(f"Воркер слушает {socket_path}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    sys.stdout = StreamRouter(sys.stdout)
+    sys.stderr = StreamRouter(sys.stderr)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()